@@ -1,133 +1,258 @@
+import ast
+import signal
+from array import array
 from bisect import bisect_right
+from functools import partial
+from struct import Struct, error as StructError
+from Components import FunctionFlow
+from Components.Memory import read, read16, read32, write, copy, load
 
 
-BIOS, RAM, ROM = bytearray(), bytearray(), bytearray()
 REG = [0]*17
-RegionMarkers = {}
 BreakState = ""
+BreakAddress = None  # address of the instruction that set BreakState during the last run()
+Interrupted = False  # set by Ctrl+C during run(), which stops before the next instruction or block
 BreakPoints = set()
-WatchPoints = set()
-ReadPoints = set()
-Conditionals = []
+WatchPoints = set()  # (start, size) ranges
+ReadPoints = set()   # (start, size) ranges
+WatchIndex = [], []  # merged ranges as sorted (starts, ends) lists, rebuilt by indexPoints()
+ReadIndex = [], []
+Conditionals = []    # expressions of the conditional breakpoints, compiled by indexConditions()
 Executing = False
+Profile = None       # called with (address, mode) before each instruction executes, while profiling
+Cover = None         # called with (start, end) of the code executed, while recording coverage
+Timing = False       # whether Cycles is counted
+Swis = {}            # swi number -> handler that emulates the BIOS function, taking REG and returning its cycles
 
 
 def undef(*args): pass
 
 
-def mem_read(addr,size=4,signed=False):
-    region = addr >> 24 & 0xF
-    if region in RegionMarkers:
-        base, length = RegionMarkers[region]
-        reladdr = (addr & 0xFFFFFF) % length + base
-        value = int.from_bytes(RAM[reladdr:reladdr + size],"little")
-    else:
-        if region >= 8:
-            reladdr = addr - 0x08000000
-            value = int.from_bytes(ROM[reladdr:reladdr+size],"little")
-        elif region == 0:
-            reladdr = addr % 0x4000
-            value = int.from_bytes(BIOS[reladdr:reladdr+size],"little")
-        else: return 0
-    if signed:
-        msb = 2**(8*size-1)
-        value = ((value^msb) - msb) & 0xFFFFFFFF
-    if addr in ReadPoints and Executing:
+def mem_read_checked(addr,size=4,signed=False):
+    value = read(addr,size,signed)
+    starts, ends = ReadIndex
+    i = bisect_right(starts, addr + size - 1) - 1
+    if i >= 0 and ends[i] > addr and Executing:
         global BreakState
         BreakState = f"ReadPoint: ${addr:0>{2*size}X} (={value:0>{2*size}X})"
     return value
 
 
-def mem_write(addr,data,size=4):
-    region = addr >> 24 & 0xF
-    if type(data) is int: data = int.to_bytes(data % 2**(8*size),size,"little")
-    else: size = len(data)
-    if addr in WatchPoints and Executing:
+def mem_write_unchecked(addr,data,size=4):
+    if type(data) is not int: size = len(data)
+    if CodePages and (size > 0x100 or addr >> 8 in CodePages or addr + size - 1 >> 8 in CodePages): invalidate(addr,size)
+    if ConditionIndex[0]: conditionWrite(addr,size)
+    write(addr,data,size)
+    if addr >> 24 == 4: ioWrite(addr,size)
+    elif addr >= 0x08000000: romWrite(addr,size)
+
+
+def romWrite(addr,size):
+    """Updates the function index and cross references if *addr* is in the ROM, rather than the SRAM above it"""
+
+    if 8 <= addr >> 24 <= 0xD: FunctionFlow.patchROM(addr,size)
+
+
+def mem_write_checked(addr,data,size=4):
+    if type(data) is not int: size = len(data)
+    starts, ends = WatchIndex
+    i = bisect_right(starts, addr + size - 1) - 1
+    if i >= 0 and ends[i] > addr and Executing:
         global BreakState
-        old, new = mem_read(addr,size), int.from_bytes(data, "little")
+        old = read(addr,size)
+        new = data % 2**(8*size) if type(data) is int else int.from_bytes(data, "little")
         BreakState = f"WatchPoint: {addr:0>8X} ({old:0>{2*size}X} -> {new:0>{2*size}X})"
-    if region in RegionMarkers:
-        base, length = RegionMarkers[region]
-        reladdr = (addr & 0xFFFFFF) % length + base
-        RAM[reladdr:reladdr+size] = data
-        if RAM[RegionMarkers[4][0] + 0xDF] & 2**7: DMA()
-    else:
-        if region >= 8:
-            reladdr = addr - 0x08000000
-            ROM[reladdr:reladdr+size] = data
-        elif region == 0:
-            reladdr = addr % 0x4000
-            BIOS[reladdr:reladdr+size] = data
+    mem_write_unchecked(addr,data,size)
+
+
+def mem_write_journaled(addr,data,size=4):
+    if type(data) is not int: size = len(data)
+    journalWrite(addr,size)
+    if WatchPoints: mem_write_checked(addr,data,size)
+    else: mem_write_unchecked(addr,data,size)
 
 
 def mem_copy(src,des,size):
-    region1 = src >> 24 & 0xF
-    region2 = des >> 24 & 0xF
-    if region1 >= 8:
-        reladdr = src - 0x08000000
-        copydata = ROM[reladdr:reladdr + size]
+    if JournalSize: journalWrite(des,size)
+    if CodePages: invalidate(des,size)
+    if ConditionIndex[0]: conditionWrite(des,size)
+    if WatchPoints and Executing:
+        starts, ends = WatchIndex
+        i = bisect_right(starts, des + size - 1) - 1
+        if i >= 0 and ends[i] > des:
+            global BreakState
+            BreakState = f"WatchPoint: {max(des, starts[i]):0>8X} (copied {size} bytes from {src:0>8X})"
+    copy(src,des,size)
+    if des >> 24 == 4: ioWrite(des,size)
+
+
+def mem_read_timed(addr,size=4,signed=False):
+    global Cycles, DataSeq
+    Cycles += Waits[size][DataSeq][addr >> 24 & 15]
+    DataSeq = 1
+    return TimedRead(addr,size,signed)
+
+
+def mem_write_timed(addr,data,size=4):
+    global Cycles, DataSeq
+    if type(data) is not int: size = len(data)
+    Cycles += Waits.get(size, Waits[4])[DataSeq][addr >> 24 & 15]
+    DataSeq = 1
+    TimedWrite(addr,data,size)
+
+
+# Swapped by indexPoints(); without any watchpoints or readpoints, accesses skip the checks entirely
+mem_read = read
+mem_write = mem_write_unchecked
+TimedRead, TimedWrite = read, mem_write_unchecked  # what mem_read_timed and mem_write_timed access memory with
+
+
+def mergeRanges(points):
+    """Returns the (start, size) ranges in *points* merged into sorted (starts, ends) lists"""
+
+    starts, ends = [], []
+    for start, size in sorted(points):
+        if ends and start <= ends[-1]: ends[-1] = max(ends[-1], start + size)
+        else: starts.append(start); ends.append(start + size)
+    return starts, ends
+
+
+def indexPoints():
+    """Rebuilds WatchIndex and ReadIndex; call after changing WatchPoints, ReadPoints, JournalSize or Timing"""
+
+    global WatchIndex, ReadIndex, mem_read, mem_write, TimedRead, TimedWrite
+    WatchIndex = mergeRanges(WatchPoints)
+    ReadIndex = mergeRanges(ReadPoints)
+    mem_read = mem_read_checked if ReadPoints else read
+    mem_write = mem_write_journaled if JournalSize else mem_write_checked if WatchPoints else mem_write_unchecked
+    if Timing:
+        TimedRead, TimedWrite = mem_read, mem_write
+        mem_read, mem_write = mem_read_timed, mem_write_timed
+
+
+def ioWrite(addr,size):
+    """Runs the IoWrites handlers of the I/O registers a write of *size* bytes at *addr* reached"""
+
+    for reg in range(addr, addr + min(size, 0x400)):
+        handler = IoWrites.get(reg)
+        if handler: handler()
+
+
+def reverseUnits(data,unit):
+    """Returns *data* with the order of its *unit*-byte units reversed"""
+
+    units = array("I" if unit == 4 else "H", data)
+    units.reverse()
+    return units.tobytes()
+
+
+def DMA(channel):
+    """Runs DMA *channel* if it's enabled to start immediately
+
+    Transfers timed to VBlank, HBlank or a sound FIFO never start, since the video and sound hardware aren't
+    emulated.  Each address steps up, down, or stays fixed as its control bits say.  While Timing is on, the
+    transfer is charged as a whole, so its writes skip the per-access charges.
+    """
+    global Cycles
+    base = 0x040000B0 + 12*channel
+    control = read16(base + 10)
+    if not control & 0x8000 or control >> 12 & 3: return
+    write = TimedWrite if Timing else mem_write
+    write(base + 10, control & 0x7FFF, 2)  # an immediate transfer is done once it starts
+    unit = 4 if control >> 10 & 1 else 2
+    src = read32(base) & (0x0FFFFFFF if channel else 0x07FFFFFF) & -unit
+    des = read32(base + 4) & (0x0FFFFFFF if channel == 3 else 0x07FFFFFF) & -unit
+    count = read16(base + 8) & (0xFFFF if channel == 3 else 0x3FFF) or (0x10000 if channel == 3 else 0x4000)
+    size = count*unit
+    srcstep, desstep = (1, -1, 0, 1)[control >> 7 & 3], (1, -1, 0, 1)[control >> 5 & 3]
+    if srcstep == desstep == 1: mem_copy(src, des, size)
     else:
-        base, length = RegionMarkers[region1]
-        reladdr = (src & 0xFFFFFF) % length + base
-        copydata = RAM[reladdr:reladdr + size]
-    try:
-        base, length = RegionMarkers[region2]
-        reladdr = (des & 0xFFFFFF) % length + base
-        RAM[reladdr:reladdr+size] = copydata
-    except KeyError:
-        reladdr = des - 0x08000000
-        ROM[reladdr:reladdr+size] = copydata
+        if srcstep == 1: data = load(src, size)
+        elif srcstep == 0: data = load(src, unit)*count
+        else: data = reverseUnits(load(src - size + unit, size), unit)
+        if desstep == 1: write(des, data)
+        elif desstep == 0: write(des, data[-unit:])
+        else: write(des - size + unit, reverseUnits(data, unit))
+    if Timing:
+        N, S = Waits[unit]
+        srcregion, desregion = src >> 24 & 15, des >> 24 & 15
+        Cycles += 2 + N[srcregion] + N[desregion] + (count - 1)*(S[srcregion] + S[desregion])
+
+
+# I/O register byte -> handler run after a write reaches it
+IoWrites = {0x040000BB + 12*channel: partial(DMA, channel) for channel in range(4)}
+
+
+# Flags are evaluated lazily: flag-setting operations only record what the flags depend on, as
+# (Op1, Op2, sum, NZ value, C), and sync() writes them into REG[16] once something reads them.
+# Op1 is None when V is unchanged, and C is None when it's unchanged.  execute() and run() always
+# sync before returning, so outside the CPU REG[16] is always up to date.
+Lazy = None
+
+
+def sync():
+    """Writes the pending flags into REG[16]"""
+
+    global Lazy
+    if not Lazy: return
+    Op1, Op2, total, nz, C = Lazy
+    Lazy = None
+    flags = REG[16]
+    N = nz >> 31 & 1
+    Z = not nz & 0xFFFFFFFF
+    if C is None: C = flags >> 29 & 1
+    V = flags >> 28 & 1 if Op1 is None else Op1 >> 31 == Op2 >> 31 != total >> 31 & 1
+    REG[16] = (N << 3 | Z << 2 | C << 1 | V) << 28 | flags & 2**28-1
+
+
+def cpsr():
+    """Returns REG[16], with the flags up to date"""
+
+    if Lazy: sync()
+    return REG[16]
 
 
-def DMA():
-    src = mem_read(0x040000D4,4)
-    des = mem_read(0x040000D8,4)
-    count = mem_read(0x040000DC,2)
-    control = mem_read(0x040000DE,2)
-    mem_copy(src, des, count*(2 + 2*(control >> 10 & 1)))
-    mem_write(0x040000DE, control & 0x7FFF, 2)
+def carry():
+    if Lazy: sync()
+    return REG[16] >> 29 & 1
 
 
 def compare(Op1,Op2,S=1):
     Op1 &= 0xFFFFFFFF
     Op2 &= 0xFFFFFFFF
     result = Op1 + Op2
-    N = 8 if result & 2**31 else 0
-    Z = 4 if not result & 0xFFFFFFFF else 0
-    C = 2 if result & 2**32 else 0
-    V = 1 if Op1 >> 31 == Op2 >> 31 != bool(N) else 0
-    if S: REG[16] = (N|Z|C|V) << 28 | REG[16] & 2**28-1
+    if S:
+        global Lazy
+        Lazy = Op1, Op2, result, result, result >> 32
     return result & 0xFFFFFFFF
 
 
 def cmphalf(result,S=1):
     result &= 0xFFFFFFFF
-    N = 8 if result & 2**31 else 0
-    Z = 4 if not result else 0
-    if S: REG[16] = (N|Z) << 28 | REG[16] & 2**30-1
+    if S:
+        global Lazy
+        Lazy = (Lazy[0], Lazy[1], Lazy[2], result, Lazy[4]) if Lazy else (None, None, None, result, None)
     return result
 
 
 def barrelshift(value,Shift,Typ,S=0,skipzero=False):
     value &= 0xFFFFFFFF
     Shift &= 31
-    affectedflags = 0xE << 28
-    C = 0
+    C = 0 if skipzero else None  # None leaves C unchanged
     if Shift: 
-        C = 2*((value >> Shift-1) & 1)  # The last bit shifted out for rshifts
-        if Typ == 0: value <<= Shift; C = 2*(value >> 32 & 1)
+        C = (value >> Shift-1) & 1  # The last bit shifted out for rshifts
+        if Typ == 0: value <<= Shift; C = value >> 32 & 1
         elif Typ == 1: value >>= Shift
         elif Typ == 2: value = (value ^ 2**31) - 2**31 >> Shift
         elif Typ == 3: value = (value << 32 | value) >> Shift
     elif not skipzero:
-        if Typ == 0: affectedflags = 0xC << 28
-        elif Typ == 1: C = 2*(value>>31); value = 0
-        elif Typ == 2: C = 2*(value>>31); value = -(value>>31)
-        elif Typ == 3: affectedflags = 0xC << 28; value = ((REG[16] & 1<<29) << 3 | value) >> 1
+        if Typ == 1: C = value>>31; value = 0
+        elif Typ == 2: C = value>>31; value = -(value>>31)
+        elif Typ == 3: value = (carry() << 32 | value) >> 1
     value &= 0xFFFFFFFF
-    N = 8 if value & 2**31 else 0
-    Z = 4 if not value else 0
-    if S: REG[16] = REG[16] & ~affectedflags | ((N|Z|C) << 28) & affectedflags
+    if S:
+        global Lazy
+        Lazy = (Lazy[0], Lazy[1], Lazy[2], value, Lazy[4] if C is None else C) if Lazy else (None, None, None, value, C)
     return value
 
 
@@ -156,22 +281,18 @@ conditions = (
 #######################
 
 
-def shifted(instr):
-    Op,Offset,Rs,Rd = instr>>11 & 3, instr>>6 & 31, instr>>3 & 7, instr & 7
+def shifted(Op,Offset,Rs,Rd):
     REG[Rd] = barrelshift(REG[Rs],Offset,Op,1)
 
 
-def addsub(instr):
-    I,Op,Rn,Rs,Rd = instr>>10 & 1, instr>>9 & 1, instr>>6 & 7, instr>>3 & 7, instr & 7
+def addsub(I,Op,Rn,Rs,Rd):
     Rs = REG[Rs]
     if not I: Rn = REG[Rn]
     if not Op: REG[Rd] = compare(Rs,Rn)
     else: REG[Rd] = compare(Rs,-Rn)
     
 
-def immediate(instr):
-    Op,Rd,Offset = instr>>11 & 3, instr>>8 & 7, instr & 0xFF
-    Op1 = REG[Rd]
+def immediate(Op,Rd,Offset):
     if Op == 0: REG[Rd] = cmphalf(Offset)
     elif Op == 1: compare(REG[Rd], -Offset)
     elif Op == 2: REG[Rd] = compare(REG[Rd], Offset)
@@ -184,8 +305,8 @@ alu_ops = (
     lambda Rd,Rs: barrelshift(Rd,Rs & 0x1F,0,1,True),      # LSL
     lambda Rd,Rs: barrelshift(Rd,Rs & 0x1F,1,1,True),      # LSR
     lambda Rd,Rs: barrelshift(Rd,Rs & 0x1F,2,1,True),      # ASR
-    lambda Rd,Rs: compare(Rd, Rs + (REG[16]>>29 & 1)),     # ADC
-    lambda Rd,Rs: compare(Rd,-Rs + (REG[16]>>29 & 1) - 1), # SBC
+    lambda Rd,Rs: compare(Rd, Rs + carry()),               # ADC
+    lambda Rd,Rs: compare(Rd,-Rs + carry() - 1),           # SBC
     lambda Rd,Rs: barrelshift(Rd,Rs & 0x1F,3,1),           # ROR
     lambda Rd,Rs: cmphalf(Rd & Rs),                        # TST
     lambda Rd,Rs: compare(0,-Rs),                          # NEG
@@ -197,16 +318,12 @@ alu_ops = (
     lambda Rd,Rs: cmphalf(~Rs),                            # MVN
 )
 
-def AluOp(instr):
-    Op,Rs,Rd = instr>>6 & 15, instr>>3 & 7, instr & 7
-    result = alu_ops[Op](REG[Rd],REG[Rs])
-    if Op not in {8,10,11}: REG[Rd] = result
+def AluOp(Op,Writeback,Rs,Rd):
+    result = Op(REG[Rd],REG[Rs])
+    if Writeback: REG[Rd] = result
 
 
-def HiRegBx(instr):
-    Op,Hd,Hs,Rs,Rd = instr>>8 & 3, instr>>7 & 1, instr>>6 & 1, instr>>3 & 7, instr & 7
-    Rd += 8*Hd
-    Rs += 8*Hs
+def HiRegBx(Op,Hd,Rs,Rd):
     if Op == 0: REG[Rd] = (REG[Rd] + REG[Rs]) & 0xFFFFFFFF
     elif Op == 1: compare(REG[Rd],-REG[Rs])
     elif Op == 2: REG[Rd] = REG[Rs]
@@ -218,13 +335,11 @@ def HiRegBx(instr):
     if Rd == 15: REG[15] += 2
 
 
-def ldr_pc(instr):
-    Rd,Word = instr>>8 & 7, instr & 0xFF
+def ldr_pc(Rd,Word):
     REG[Rd] = mem_read(REG[15] + Word*4 - (REG[15] & 2), 4)
 
 
-def ldrstr(instr):
-    Op,S,Ro,Rb,Rd = instr>>10 & 3, instr>>9 & 1, instr>>6 & 7, instr>>3 & 7, instr & 7
+def ldrstr(Op,S,Ro,Rb,Rd):
     addr = REG[Rb] + REG[Ro]
     if not S:
         if Op == 0: mem_write(addr, REG[Rd], 4)
@@ -238,38 +353,28 @@ def ldrstr(instr):
         elif Op == 3: REG[Rd] = mem_read(addr, 2, True)
 
 
-def ldrstr_imm(instr):
-    Op,L,Offset,Rb,Rd = instr>>12 & 3, instr>>11 & 1, instr>>6 & 31, instr>>3 & 7, instr & 7
-    size = Op^2 if Op != 2 else 4  # (3,2,0) -> (1,4,2)
-    addr = REG[Rb] + Offset*size
+def ldrstr_imm(L,size,Offset,Rb,Rd):
+    addr = REG[Rb] + Offset
     if not L: mem_write(addr, REG[Rd], size)
     else: REG[Rd] = mem_read(addr, size)
 
 
-def ldrstr_sp(instr):
-    Op,Rd,Word = instr>>11 & 1, instr>>8 & 7, instr & 0xFF
-    if not Op: mem_write(REG[13] + Word*4, REG[Rd], 4)
-    else: REG[Rd] = mem_read(REG[13] + Word*4, 4)
+def ldrstr_sp(Op,Rd,Offset):
+    if not Op: mem_write(REG[13] + Offset, REG[Rd], 4)
+    else: REG[Rd] = mem_read(REG[13] + Offset, 4)
 
 
-def get_reladdr(instr):
-    Op,Rd,Word = instr>>11 & 1, instr>>8 & 7, instr & 0xFF
-    if not Op: REG[Rd] = (REG[15] & ~2) + Word*4
-    else: REG[Rd] = REG[13] + Word*4
+def get_reladdr(Op,Rd,Offset):
+    if not Op: REG[Rd] = (REG[15] & ~2) + Offset
+    else: REG[Rd] = REG[13] + Offset
     REG[Rd] &= 0xFFFFFFFF
 
 
-def add_sp(instr):
-    S,Word = instr>>7 & 1, instr & 0x7F
-    if not S: REG[13] += Word*4
-    else: REG[13] -= Word*4
-    REG[13] &= 0xFFFFFFFF
+def add_sp(Offset):
+    REG[13] = (REG[13] + Offset) & 0xFFFFFFFF
 
 
-def pushpop(instr):
-    Op,Rlist = instr>>11 & 1, instr & 0x1FF
-    Rlist = [i for i in range(9) if Rlist & 2**i]
-    if Rlist[-1] == 8: Rlist[-1] = 14 + Op
+def pushpop(Op,Rlist):
     if not Op:
         for i in reversed(Rlist):
             REG[13] -= 4
@@ -282,25 +387,22 @@ def pushpop(instr):
     REG[13] &= 0xFFFFFFFF
 
 
-def stmldm(instr):
-    Op,Rb,Rlist = instr>>11 & 1, instr>>8 & 7, instr & 0xFF
+def stmldm(Op,Rb,Rlist):
     addr = REG[Rb]
-    for i in range(8):
-        if Rlist & 2**i:
-            if not Op: mem_write(addr, REG[i], 4)
-            else: REG[i] = mem_read(addr, 4)
-            addr += 4
+    for i in Rlist:
+        if not Op: mem_write(addr, REG[i], 4)
+        else: REG[i] = mem_read(addr, 4)
+        addr += 4
     REG[Rb] = addr & 0xFFFFFFFF
 
 
-def b_if(instr):
-    Cond,Offset = instr>>8 & 15, instr & 0xFF
-    if conditions[Cond](REG[16]>>28): 
-        REG[15] = (REG[15] + ((Offset^0x80) - 0x80)*2 + 2) & 0xFFFFFFFF
+def b_if(Cond,Offset):
+    if conditions[Cond](cpsr()>>28): 
+        REG[15] = (REG[15] + Offset) & 0xFFFFFFFF
 
 
-def branch(instr):
-    REG[15] = (REG[15] + ((instr & 0x7FF ^ 0x400) - 0x400)*2 + 2) & 0xFFFFFFFF
+def branch(Offset):
+    REG[15] = (REG[15] + Offset) & 0xFFFFFFFF
 
 
 def bl(instr):
@@ -313,6 +415,22 @@ def bl(instr):
         REG[15] = (REG[15] + (((instr & 0x7FF ^ 0x400) << 11 | (instr >> 16) & 0x7FF) - 0x200000)*2 + 2) & 0xFFFFFFFF
 
 
+def swi(Comment):
+    """Runs the handler in Swis for BIOS function *Comment*; other BIOS functions are skipped"""
+
+    global Cycles
+    handler = Swis.get(Comment)
+    if handler:
+        cycles = handler(REG)
+        if Timing: Cycles += cycles
+
+
+def pushpop_rlist(Op,Rlist):
+    Rlist = [i for i in range(9) if Rlist & 2**i]
+    if Rlist and Rlist[-1] == 8: Rlist[-1] = 14 + Op
+    return tuple(Rlist)
+
+
 ThumbBounds = (
     0x1800,0x2000,0x4000,0x4400,0x4800,0x5000,0x6000,0x8000,0x9000,0xA000,
     0xB000,0xB400,0xBE00,0xC000,0xD000,0xDE00,0xDF00,0xE000,0xE800,0xF000,
@@ -320,10 +438,45 @@ ThumbBounds = (
 
 ThumbFuncs = (
     shifted, addsub, immediate, AluOp, HiRegBx, ldr_pc, ldrstr, ldrstr_imm, ldrstr_imm, ldrstr_sp,
-    get_reladdr, add_sp, pushpop, undef, stmldm, b_if, undef, undef, branch, undef, bl
+    get_reladdr, add_sp, pushpop, undef, stmldm, b_if, undef, swi, branch, undef, bl
+)
+
+# Splits a 16-bit instruction into the arguments of its ThumbFuncs handler
+ThumbFields = (
+    lambda i: (i>>11 & 3, i>>6 & 31, i>>3 & 7, i & 7),                                     # shifted
+    lambda i: (i>>10 & 1, i>>9 & 1, i>>6 & 7, i>>3 & 7, i & 7),                            # addsub
+    lambda i: (i>>11 & 3, i>>8 & 7, i & 0xFF),                                             # immediate
+    lambda i: (alu_ops[i>>6 & 15], (i>>6 & 15) not in {8,10,11}, i>>3 & 7, i & 7),         # AluOp
+    lambda i: (i>>8 & 3, i>>7 & 1, (i>>3 & 7) + 8*(i>>6 & 1), (i & 7) + 8*(i>>7 & 1)),     # HiRegBx
+    lambda i: (i>>8 & 7, i & 0xFF),                                                        # ldr_pc
+    lambda i: (i>>10 & 3, i>>9 & 1, i>>6 & 7, i>>3 & 7, i & 7),                            # ldrstr
+    lambda i: (i>>11 & 1, (2,0,4,1)[i>>12 & 3], (i>>6 & 31)*(2,0,4,1)[i>>12 & 3], i>>3 & 7, i & 7),   # ldrstr_imm
+    lambda i: (i>>11 & 1, (2,0,4,1)[i>>12 & 3], (i>>6 & 31)*(2,0,4,1)[i>>12 & 3], i>>3 & 7, i & 7),   # ldrstr_imm
+    lambda i: (i>>11 & 1, i>>8 & 7, (i & 0xFF)*4),                                         # ldrstr_sp
+    lambda i: (i>>11 & 1, i>>8 & 7, (i & 0xFF)*4),                                         # get_reladdr
+    lambda i: ((i & 0x7F)*(-4 if i & 0x80 else 4),),                                       # add_sp
+    lambda i: (i>>11 & 1, pushpop_rlist(i>>11 & 1, i & 0x1FF)),                            # pushpop
+    lambda i: (),
+    lambda i: (i>>11 & 1, i>>8 & 7, tuple(j for j in range(8) if i & 2**j)),               # stmldm
+    lambda i: (i>>8 & 15, ((i & 0xFF ^ 0x80) - 0x80)*2 + 2),                               # b_if
+    lambda i: (),
+    lambda i: (i & 0xFF,),                                                                 # swi
+    lambda i: (((i & 0x7FF ^ 0x400) - 0x400)*2 + 2,),                                      # branch
+    lambda i: (),
+    lambda i: (i,),                                                                        # bl
 )
 
 
+def decodeThumb(instr):
+    """Returns a callable that executes the 16-bit Thumb instruction *instr*"""
+
+    ID = bisect_right(ThumbBounds,instr)
+    return partial(ThumbFuncs[ID], *ThumbFields[ID](instr))
+
+
+ThumbTable = [decodeThumb(instr) for instr in range(0x10000)]
+
+
 
 #####################
 ### ARM FUNCTIONS ###
@@ -336,9 +489,9 @@ dataprocess_list = (
     lambda Rn,Op2,S: compare(Rn, -Op2, S),                         # SUB
     lambda Rn,Op2,S: compare(Op2, -Rn, S),                         # RSB
     lambda Rn,Op2,S: compare(Rn, Op2, S),                          # ADD
-    lambda Rn,Op2,S: compare(Rn, Op2 + (REG[16]>>29 & 1), S),      # ADC
-    lambda Rn,Op2,S: compare(Rn,-Op2 + (REG[16]>>29 & 1) - 1, S),  # SBC
-    lambda Rn,Op2,S: compare(Op2,-Rn + (REG[16]>>29 & 1) - 1, S),  # RSC
+    lambda Rn,Op2,S: compare(Rn, Op2 + carry(), S),                # ADC
+    lambda Rn,Op2,S: compare(Rn,-Op2 + carry() - 1, S),            # SBC
+    lambda Rn,Op2,S: compare(Op2,-Rn + carry() - 1, S),            # RSC
     lambda Rn,Op2,S: cmphalf(Rn & Op2, S),                         # TST
     lambda Rn,Op2,S: cmphalf(Rn ^ Op2, S),                         # TEQ
     lambda Rn,Op2,S: compare(Rn, -Op2, S),                         # CMP
@@ -376,8 +529,8 @@ def psr(instr):
             bitmask = 15<<28*(Field>>3) | 0xEF*(Field & 1)
             if I: Op = barrelshift(Imm, Shift*2, 3)
             else: Op = REG[Rm]
-            REG[16] = REG[16] & ~bitmask | Op & bitmask
-        else: R[Rd] = R[16]
+            REG[16] = cpsr() & ~bitmask | Op & bitmask
+        else: REG[Rd] = cpsr()
 
 
 def arm_bx(instr):
@@ -431,7 +584,7 @@ def multiply(instr):
         if S:
             N = 8 if result & 2**63 else 0
             Z = 4 if not result & 2**63-1 else 0
-            REG[16] = (N|Z)<<28 | (REG[16] & 2**30-1)
+            REG[16] = (N|Z)<<28 | (cpsr() & 2**30-1)
 
 
 def datatransfer(instr):
@@ -486,6 +639,10 @@ def blocktransfer(instr):
     if W: REG[Rn] = addr
 
 
+def arm_swi(instr):
+    swi(instr >> 16 & 0xFF)
+
+
 arm_tree = {
     0:(27,36), 1:(26,31), 2:(25,28), 3:(4,9), 4:([25<<20,16<<20],6), 5:dataprocess, 6:(7,8), 7:psr, 
     8:multiply, 9:(7,19), 10:([25<<20,16<<20],12), 11:dataprocess, 12:(6,16), 13:(22,15), 14:arm_bx, 15:clz, 
@@ -493,7 +650,7 @@ arm_tree = {
     24:(23,26), 25:multiply, 26:multiply, 27:datatransfer, 28:([25<<20,16<<20],30), 29:dataprocess, 30:psr, 31:(25,33), 
     32:datatransfer, 33:(4,35), 34:datatransfer, 35:undef, 36:(26,40), 37:(25,39), 38:blocktransfer, 39:arm_branch,
     40:(25,44), 41:([15<<21,2<<21],43), 42:undef, 43:undef, 44:(24,48), 45:(4,47), 46:undef, 47:undef,
-    48:undef
+    48:arm_swi
 }
 
 
@@ -513,20 +670,558 @@ def navigateTree(instr,tree):
             return tree[treepos]
 
 
+def decodeTable(tree):
+    """Precomputes navigateTree over every combination of the bits it tests (bits 4-7 and 20-27)"""
+
+    return [navigateTree((key & 0xFF0) << 16 | (key & 15) << 4, tree) for key in range(0x1000)]
+
+
+def armIndex(instr):
+    """Returns the index into a decodeTable for the 32-bit ARM instruction *instr*"""
+
+    return instr >> 16 & 0xFF0 | instr >> 4 & 15
+
+
+ArmTable = decodeTable(arm_tree)
+
+
 def execute(instr,mode):
     global BreakState, Executing
     BreakState = ""
     Executing = True
-    # THUMB
-    if mode:
-        REG[15] += 2
-        ID = bisect_right(ThumbBounds,instr)
-        ThumbFuncs[ID](instr)
-    # ARM
+    if ChangeConditions: watchConditions()
+    addr = REG[15] - 4 + 2*mode
+    try:
+        if Profile: Profile(addr, mode)
+        if Timing: timeInstruction(addr, instr, mode)
+        if JournalSize: journal()
+        # THUMB
+        if mode:
+            if Cover: Cover(REG[15] - 2, REG[15] + (2 if instr > 0xFFFF else 0))
+            REG[15] += 2
+            if instr > 0xFFFF: bl(instr)
+            else: ThumbTable[instr]()
+        # ARM
+        else:
+            if Cover: Cover(REG[15] - 4, REG[15])
+            REG[15] += 4
+            Cond = instr >> 28
+            if Cond == 14 or conditions[Cond](cpsr()>>28):
+                ArmTable[instr >> 16 & 0xFF0 | instr >> 4 & 15](instr)
+        if Timing and REG[15] != addr + 8 - 4*mode: refill()
+    finally:
+        if Lazy: sync()
+    if ChangeConditions: checkConditions()
+    Executing = False
+
+def run(count,stops=()):
+    """Executes up to *count* instructions in one loop, without returning to the debugger in between
+
+    The first instruction is always executed.  After that, execution stops before any address in *stops* or
+    BreakPoints, and after any instruction that sets BreakState.  Thumb code runs as compiled blocks whenever
+    no stop address falls inside the block, the journal, profiler and cycle counting are off, and no conditional
+    breakpoint reads a register.  Conditional breakpoints are all checked after the first instruction, so one
+    that is already true stops there.
+    Returns (instructions executed, reason), where reason is "count", "address", "break" or "interrupt"; on a
+    break, BreakAddress is the address of the instruction that set BreakState.
+    """
+    global BreakState, BreakAddress, Executing, Interrupted
+    stops = BreakPoints.union(stops)
+    R = REG
+    clear = {}  # start address -> (block, whether no stop address lies inside it)
+    executed = 0
+    reason = "count"
+    BreakState = ""
+    BreakAddress = None
+    Executing = True
+    Interrupted = False
+    if ChangeConditions: watchConditions()
+    if Timing: updateWaits()
+    handler = signal.signal(signal.SIGINT, interrupt)
+    try:
+        while executed < count:
+            if Interrupted: reason = "interrupt"; break
+            # THUMB
+            if R[16] & 32:
+                addr = R[15] - 2 & ~1
+                if executed and addr in stops: reason = "address"; break
+                if Profile: Profile(addr, 1)
+                if JournalSize: journal()
+                elif not (ConditionRegs or Profile or Timing) and (executed or not ChangeConditions):
+                    block = Blocks.get(addr) or compileBlock(addr)
+                    if count - executed >= block[2]:
+                        entry = clear.get(addr)
+                        if entry is None or entry[0] is not block:
+                            entry = clear[addr] = block, not any(addr < i < block[1] for i in stops)
+                        if entry[1]:
+                            done = block[0]()
+                            executed += done
+                            if Cover: Cover(addr, block[1] if done == block[2] else R[15] - 2)
+                            if ConditionWritten: checkConditions()
+                            if BreakState:  # blocks stop right after the instruction, unless it ended the block
+                                BreakAddress = R[15] - 4 if done < block[2] else block[3]
+                                reason = "break"; break
+                            continue
+                instr = read16(addr)
+                if Cover: Cover(addr, addr + (4 if 0xF000 <= instr < 0xF800 else 2))
+                if Timing: timeInstruction(addr, instr, 1)
+                R[15] += 2
+                if 0xF000 <= instr < 0xF800: bl(read32(addr))
+                else: ThumbTable[instr]()
+                if Timing and R[15] != addr + 4: refill()
+            # ARM
+            else:
+                addr = R[15] - 4 & ~3
+                if executed and addr in stops: reason = "address"; break
+                if Profile: Profile(addr, 0)
+                if JournalSize: journal()
+                instr = read32(addr)
+                if Cover: Cover(addr, addr + 4)
+                if Timing: timeInstruction(addr, instr, 0)
+                R[15] += 4
+                if instr >> 28 == 14 or conditions[instr >> 28](cpsr()>>28):
+                    ArmTable[instr >> 16 & 0xFF0 | instr >> 4 & 15](instr)
+                if Timing and R[15] != addr + 8: refill()
+            executed += 1
+            if ChangeConditions: checkConditions()
+            if BreakState: BreakAddress = addr; reason = "break"; break
+    except KeyboardInterrupt: reason = "interrupt"
+    finally:
+        signal.signal(signal.SIGINT, handler)
+        Executing = False
+        if Lazy: sync()
+    return executed, reason
+
+
+def interrupt(signum, frame):
+    """Handles Ctrl+C during run() by stopping it between instructions, as a compiled block only keeps REG[15]
+    right at its exits"""
+
+    global Interrupted
+    Interrupted = True
+
+
+####################
+### BASIC BLOCKS ###
+####################
+
+
+Blocks = {}     # start address -> (compiled function, end address, instruction count, address of the last instruction)
+CodePages = {}  # addr >> 8 -> start addresses of the blocks that cover the page
+BlockLimit = 64
+BlockWritten = False  # set when a write invalidates a block, so a running block can't go on with stale code
+
+# flags returned with the source of an instruction
+READS_PC, MEMORY, ENDS_BLOCK = 1, 2, 4
+
+ldrstr_source = (
+    ("mem_write({0}, R[{1}], 4)", "mem_write({0}, R[{1}], 1)", "R[{1}] = mem_read({0}, 4)", "R[{1}] = mem_read({0}, 1)"),
+    ("mem_write({0}, R[{1}], 2)", "R[{1}] = mem_read({0}, 1, True)", "R[{1}] = mem_read({0}, 2)", "R[{1}] = mem_read({0}, 2, True)"),
+)
+
+# Handler -> lambda(addr, instr, *handler args) returning (source, flags) for the instruction
+ThumbSources = {
+    shifted: lambda a,i,Op,Offset,Rs,Rd: (f"R[{Rd}] = barrelshift(R[{Rs}],{Offset},{Op},1)", 0),
+    addsub: lambda a,i,I,Op,Rn,Rs,Rd: (f"R[{Rd}] = compare(R[{Rs}],{'-' if Op else ''}{Rn if I else f'R[{Rn}]'})", 0),
+    immediate: lambda a,i,Op,Rd,Offset: ((
+        f"R[{Rd}] = cmphalf({Offset})", f"compare(R[{Rd}],-{Offset})",
+        f"R[{Rd}] = compare(R[{Rd}],{Offset})", f"R[{Rd}] = compare(R[{Rd}],-{Offset})")[Op], 0),
+    AluOp: lambda a,i,Op,Writeback,Rs,Rd: (f"{f'R[{Rd}] = ' if Writeback else ''}alu_ops[{i>>6 & 15}](R[{Rd}],R[{Rs}])", 0),
+    HiRegBx: lambda a,i,Op,Hd,Rs,Rd: (f"ThumbTable[{i:#x}]()", READS_PC | ENDS_BLOCK) if Op == 3 or Rd == 15 else ((
+        f"R[{Rd}] = (R[{Rd}] + R[{Rs}]) & 0xFFFFFFFF", f"compare(R[{Rd}],-R[{Rs}])", f"R[{Rd}] = R[{Rs}]")[Op],
+        READS_PC if Rs == 15 else 0),
+    ldr_pc: lambda a,i,Rd,Word: (f"R[{Rd}] = mem_read({a+4 + Word*4 - (a+4 & 2):#x}, 4)", MEMORY),
+    ldrstr: lambda a,i,Op,S,Ro,Rb,Rd: (ldrstr_source[S][Op].format(f"R[{Rb}] + R[{Ro}]", Rd), MEMORY),
+    ldrstr_imm: lambda a,i,L,size,Offset,Rb,Rd: (
+        f"R[{Rd}] = mem_read(R[{Rb}] + {Offset}, {size})" if L else f"mem_write(R[{Rb}] + {Offset}, R[{Rd}], {size})", MEMORY),
+    ldrstr_sp: lambda a,i,Op,Rd,Offset: (
+        f"R[{Rd}] = mem_read(R[13] + {Offset}, 4)" if Op else f"mem_write(R[13] + {Offset}, R[{Rd}], 4)", MEMORY),
+    get_reladdr: lambda a,i,Op,Rd,Offset: (
+        f"R[{Rd}] = (R[13] + {Offset}) & 0xFFFFFFFF" if Op else f"R[{Rd}] = {(a+4 & ~2) + Offset & 0xFFFFFFFF:#x}", 0),
+    add_sp: lambda a,i,Offset: (f"R[13] = (R[13] + {Offset}) & 0xFFFFFFFF", 0),
+    pushpop: lambda a,i,Op,Rlist: (f"ThumbTable[{i:#x}]()", READS_PC | MEMORY | (ENDS_BLOCK if Rlist[-1:] == (15,) else 0)),
+    stmldm: lambda a,i,Op,Rb,Rlist: (f"ThumbTable[{i:#x}]()", MEMORY),
+    b_if: lambda a,i,Cond,Offset: (
+        f"R[15] = {a+4 + Offset & 0xFFFFFFFF:#x} if conditions[{Cond}](cpsr()>>28) else {a+4:#x}", ENDS_BLOCK),
+    branch: lambda a,i,Offset: (f"R[15] = {a+4 + Offset & 0xFFFFFFFF:#x}", ENDS_BLOCK),
+}
+
+
+def thumbSource(addr,instr):
+    """Returns (source, flags) for the Thumb instruction *instr* located at *addr*"""
+
+    if instr > 0xFFFF:  # bl
+        target = (addr+4 + (((instr & 0x7FF ^ 0x400) << 11 | (instr >> 16) & 0x7FF) - 0x200000)*2 + 2) & 0xFFFFFFFF
+        return f"R[14] = {addr+5:#x}; R[15] = {target:#x}", ENDS_BLOCK
+    handler = ThumbTable[instr]
+    if handler.func in ThumbSources:
+        return ThumbSources[handler.func](addr, instr, *handler.args)
+    return f"ThumbTable[{instr:#x}]()", READS_PC | ENDS_BLOCK
+
+
+def compileBlock(addr):
+    """Compiles the run of Thumb instructions starting at *addr* into one function, and caches it in Blocks
+
+    The function executes the instructions up to and including the first branch (or BlockLimit instructions),
+    leaving REG[15] as execute() would.  It returns the number of instructions executed, stopping early if a
+    watchpoint or readpoint sets BreakState, if a write invalidates any block, or if a write reaches memory read
+    by a conditional breakpoint.
+    """
+    lines = ["def block():", "    global BlockWritten", "    BlockWritten = False", "    R = REG"]
+    pos = addr
+    for count in range(1, BlockLimit + 1):
+        last = pos
+        instr = read16(pos)
+        size = 2
+        if 0xF000 <= instr < 0xF800: instr = read32(pos); size = 4
+        source, flags = thumbSource(pos, instr)
+        if flags & READS_PC: lines.append(f"    R[15] = {pos+4:#x}")
+        lines.append(f"    {source}")
+        if flags & ENDS_BLOCK: break
+        if flags & MEMORY:
+            lines.append(f"    if BreakState or BlockWritten or ConditionWritten: R[15] = {pos+4:#x}; return {count}")
+        pos += size
     else:
-        REG[15] += 4
-        Cond = instr >> 28
-        if conditions[Cond](REG[16]>>28):
-            arm_function = navigateTree(instr,arm_tree)
-            arm_function(instr)
-    Executing = False
\ No newline at end of file
+        size = 0
+        lines.append(f"    R[15] = {pos+2:#x}")
+    lines.append(f"    return {count}")
+    end = pos + size
+    namespace = {}
+    exec(compile("\n".join(lines), f"<block ${addr:0>8X}>", "exec"), globals(), namespace)
+    Blocks[addr] = block = namespace["block"], end, count, last
+    for page in range(addr >> 8, (end - 1 >> 8) + 1):
+        CodePages.setdefault(page, set()).add(addr)
+    return block
+
+
+def invalidate(addr,size=1):
+    """Discards the compiled blocks that cover any of the *size* bytes at *addr*"""
+
+    global BlockWritten
+    for page in range(addr >> 8, (addr + size - 1 >> 8) + 1):
+        for start in CodePages.pop(page, ()):
+            Blocks.pop(start, None)
+            BlockWritten = True
+
+
+def flushBlocks():
+    """Discards all compiled blocks"""
+
+    Blocks.clear()
+    CodePages.clear()
+
+
+###############
+### JOURNAL ###
+###############
+
+
+# While JournalSize is nonzero, the registers before each instruction and the values each instruction overwrites
+# are recorded in ring buffers, so that the last JournalSize instructions can be undone with undo().
+# Instruction n is stored at n % JournalSize, and write n at n % len(JournalAddrs)
+JournalSize = 0
+JournalRegs = bytearray()   # REG before each instruction, packed as 17 words
+JournalFlags = []           # Lazy before each instruction
+JournalMarks = array("Q")   # number of writes logged before each instruction
+JournalAddrs = array("I")   # address of each write
+JournalValues = array("I")  # value overwritten by each write
+JournalSizes = bytearray()  # size of each write
+JournalCount = 0            # number of instructions recorded, minus the ones undone
+JournalFirst = 0            # first instruction that can be undone
+JournalLogged = 0           # number of writes logged, minus the ones undone
+JournalTop = 0              # most writes ever logged; writes before JournalTop - len(JournalAddrs) are overwritten
+PackREG, UnpackREG = Struct("<17I").pack_into, Struct("<17I").unpack_from
+
+
+def startJournal(size):
+    """Discards the journal, and records the next *size* instructions from now on; a size of 0 stops recording"""
+
+    global JournalSize, JournalRegs, JournalFlags, JournalMarks, JournalAddrs, JournalValues, JournalSizes
+    global JournalCount, JournalFirst, JournalLogged, JournalTop
+    JournalSize = size
+    JournalRegs = bytearray(68*size)
+    JournalFlags = [None]*size
+    JournalMarks = array("Q", bytes(8*size))
+    JournalAddrs = array("I", bytes(8*size))
+    JournalValues = array("I", bytes(8*size))
+    JournalSizes = bytearray(2*size)
+    JournalCount = JournalFirst = JournalLogged = JournalTop = 0
+    indexPoints()
+
+
+def clearJournal():
+    """Forgets the recorded instructions; call when the state changes other than by executing instructions"""
+
+    global JournalFirst
+    JournalFirst = JournalCount
+
+
+def journal():
+    """Records the registers before an instruction executes"""
+
+    global JournalCount, JournalFirst
+    i = JournalCount % JournalSize
+    try: PackREG(JournalRegs, 68*i, *REG)
+    except StructError: PackREG(JournalRegs, 68*i, *[value & 0xFFFFFFFF for value in REG])
+    JournalFlags[i] = Lazy
+    JournalMarks[i] = JournalLogged
+    JournalCount += 1
+    if JournalCount - JournalFirst > JournalSize: JournalFirst += 1
+
+
+def journalWrite(addr,size):
+    """Records the *size* bytes at *addr* before they're overwritten"""
+
+    global JournalLogged, JournalTop
+    length = len(JournalAddrs)
+    for addr in range(addr, addr + size, 4):
+        i = JournalLogged % length
+        JournalAddrs[i] = addr & 0xFFFFFFFF
+        JournalSizes[i] = chunk = min(size, 4)
+        JournalValues[i] = read(addr, chunk)
+        JournalLogged += 1
+        size -= 4
+    if JournalLogged > JournalTop: JournalTop = JournalLogged
+
+
+def undo():
+    """Undoes the last recorded instruction; returns False if there's none left to undo"""
+
+    global JournalCount, JournalFirst, JournalLogged, Lazy
+    if JournalCount == JournalFirst: return False
+    i = (JournalCount - 1) % JournalSize
+    mark = JournalMarks[i]
+    length = len(JournalAddrs)
+    if mark < JournalTop - length:  # its writes were overwritten in the ring
+        JournalFirst = JournalCount
+        return False
+    JournalCount -= 1
+    while JournalLogged > mark:
+        JournalLogged -= 1
+        j = JournalLogged % length
+        addr, size = JournalAddrs[j], JournalSizes[j]
+        if CodePages: invalidate(addr,size)
+        write(addr, JournalValues[j], size)
+        romWrite(addr,size)
+    REG[:] = UnpackREG(JournalRegs, 68*i)
+    Lazy = JournalFlags[i]
+    sync()
+    return True
+
+
+def journalWatchHit():
+    """Returns the first watched address written by the last recorded instruction, or None"""
+
+    if JournalCount == JournalFirst: return
+    starts, ends = WatchIndex
+    length = len(JournalAddrs)
+    for n in range(JournalMarks[(JournalCount - 1) % JournalSize], JournalLogged):
+        addr = JournalAddrs[n % length]
+        i = bisect_right(starts, addr + JournalSizes[n % length] - 1) - 1
+        if i >= 0 and ends[i] > addr: return max(addr, starts[i])
+
+
+###############################
+### CONDITIONAL BREAKPOINTS ###
+###############################
+
+
+# Conditions that only read constant registers and memory addresses are re-evaluated by execute() and run() only
+# after an instruction changes one of those registers or writes to that memory.  The rest are left to the debugger,
+# which evaluates them before every instruction.
+Conditions = []          # (expression, code, registers, ranges) for each of Conditionals
+ChangeConditions = []    # the ones evaluated when what they read changes
+StepConditions = []      # (expression, code) of the ones evaluated before every instruction
+ConditionRegs = ()       # registers read by ChangeConditions
+ConditionIndex = [], []  # merged memory ranges read by ChangeConditions, as (starts, ends) lists
+ConditionValues = None   # ConditionRegs as they were at the last check, or None to check every condition
+ConditionWritten = False # set when a write reaches ConditionIndex
+ConstantNodes = (ast.Constant, ast.UnaryOp, ast.BinOp, ast.unaryop, ast.operator)
+ValueNodes = ConstantNodes + (ast.Expression, ast.BoolOp, ast.Compare, ast.IfExp, ast.boolop, ast.cmpop, ast.expr_context)
+
+
+def constant(node):
+    """Returns the value of *node* if it's made only of numbers and operators, otherwise None"""
+
+    if not all(isinstance(i, ConstantNodes) for i in ast.walk(node)): return None
+    value = eval(compile(ast.Expression(node), "<condition>", "eval"), {"__builtins__": {}})
+    return value if type(value) is int else None
+
+
+def conditionReads(tree):
+    """Returns (registers, ranges) read by the condition *tree*, or None if it reads anything else"""
+
+    registers, ranges = set(), []
+    pending = [tree]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == "REG":
+            index = constant(node.slice)
+            if index is None or not 0 <= index < 16: return None  # REG[16] may be out of date while running
+            registers.add(index)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "mem_read":
+            args = [constant(i) for i in node.args]
+            if node.keywords or not 1 <= len(args) <= 3 or None in args: return None
+            ranges.append((args[0], args[1] if len(args) > 1 else 4))
+        elif isinstance(node, ValueNodes): pending.extend(ast.iter_child_nodes(node))
+        else: return None
+    return (registers, ranges) if registers or ranges else None
+
+
+def indexConditions():
+    """Compiles Conditionals into Conditions; call after changing Conditionals"""
+
+    global ConditionRegs, ConditionIndex, ChangeConditions, StepConditions
+    Conditions.clear()
+    for expression in Conditionals:
+        tree = ast.parse(expression, mode="eval")
+        reads = conditionReads(tree)
+        Conditions.append((expression, compile(tree, "<condition>", "eval"), *(reads or (None, None))))
+    ChangeConditions = [i for i in Conditions if i[2] is not None]
+    StepConditions = [i[:2] for i in Conditions if i[2] is None]
+    ConditionRegs = tuple(sorted(set().union(*[i[2] for i in ChangeConditions])))
+    ConditionIndex = mergeRanges([r for i in ChangeConditions for r in i[3]])
+
+
+def conditionWrite(addr,size):
+    global ConditionWritten
+    starts, ends = ConditionIndex
+    i = bisect_right(starts, addr + size - 1) - 1
+    if i >= 0 and ends[i] > addr: ConditionWritten = True
+
+
+def watchConditions():
+    """Makes the next checkConditions() evaluate every condition, and take the values it looks for changes from"""
+
+    global ConditionValues, ConditionWritten
+    ConditionValues = None
+    ConditionWritten = True
+
+
+def checkConditions():
+    """Re-evaluates the conditions that read something changed since the last check, and sets BreakState if one is true"""
+
+    global BreakState, ConditionValues, ConditionWritten
+    values = [REG[i] for i in ConditionRegs]
+    if values == ConditionValues and not ConditionWritten: return
+    first = ConditionValues is None  # a condition that's already true stops as soon as the first check
+    changed = {i for i, old, new in zip(ConditionRegs, ConditionValues or (), values) if old != new}
+    written = ConditionWritten
+    ConditionValues, ConditionWritten = values, False
+    namespace = {"REG": REG, "mem_read": read, "__builtins__": {}}
+    for expression, code, registers, ranges in ChangeConditions:
+        if (first or written and ranges or not changed.isdisjoint(registers)) and eval(code, namespace):
+            BreakState = f"BreakPoint: {expression}"
+
+
+##############
+### CYCLES ###
+##############
+
+
+# While Timing is on, every instruction adds its cycles to Cycles: the S cycle of its fetch, N and S cycles for
+# its data accesses (counted by mem_read_timed and mem_write_timed), its I cycles, and N + S to refill the pipeline
+# when it changes the pc.  Wait states depend on the region and width of each access, and on WAITCNT for the ROM.
+Cycles = 0
+DataSeq = 0           # 1 once the current instruction has accessed memory, so its next access is sequential
+WaitCnt = None        # the WAITCNT value Waits was built for
+Waits = {}            # access size -> (N cycles, S cycles) -> cycles of an access to each region (addr >> 24 & 15)
+WideRegions = {0, 3, 4, 7}  # regions with a 32-bit bus
+Kinds = {}, {}        # mode -> instr -> (I cycles, whether it stores, whether it's a Thumb bl, multiplier register)
+
+
+def buildWaits(waitcnt):
+    """Returns Waits for the WAITCNT value *waitcnt*"""
+
+    first = (4, 3, 2, 8)
+    N, S = [1]*16, [1]*16
+    N[2] = S[2] = 3  # EWRAM
+    for regions, n, s in (((8, 9), first[waitcnt >> 2 & 3], (2, 1)[waitcnt >> 4 & 1]),
+            ((10, 11), first[waitcnt >> 5 & 3], (4, 1)[waitcnt >> 7 & 1]),
+            ((12, 13), first[waitcnt >> 8 & 3], (8, 1)[waitcnt >> 10 & 1]),
+            ((14, 15), first[waitcnt & 3], first[waitcnt & 3])):
+        for i in regions: N[i], S[i] = 1 + n, 1 + s
+    N32 = [N[i] if i in WideRegions else N[i] + S[i] for i in range(16)]
+    S32 = [S[i] if i in WideRegions else 2*S[i] for i in range(16)]
+    return {1: (N, S), 2: (N, S), 4: (N32, S32)}
+
+
+def updateWaits():
+    """Rebuilds Waits if WAITCNT has changed"""
+
+    global WaitCnt, Waits
+    waitcnt = read16(0x04000204)
+    if waitcnt != WaitCnt: WaitCnt, Waits = waitcnt, buildWaits(waitcnt)
+
+
+IoWrites[0x04000204] = IoWrites[0x04000205] = updateWaits
+
+
+def startTiming(on=True):
+    """Turns counting Cycles on or off"""
+
+    global Timing
+    Timing = on
+    updateWaits()
+    indexPoints()
+
+
+def classify(instr, mode):
+    """Returns (I cycles, whether it stores, whether it's a Thumb bl, multiplier register) for *instr*"""
+
+    if mode:
+        if instr > 0xFFFF or 0xF000 <= instr < 0xF800: return 0, False, True, None
+        handler = ThumbTable[instr]
+        func, args = handler.func, handler.args
+        if func is ldr_pc: return 1, False, False, None
+        if func is ldrstr: load = args[0] >= (1 if args[1] else 2)
+        elif func in (ldrstr_imm, ldrstr_sp, pushpop, stmldm): load = args[0]
+        elif func is AluOp:
+            op = instr >> 6 & 15
+            return int(op in (2, 3, 4, 7)), False, False, (instr & 7 if op == 13 else None)
+        else: return 0, False, False, None
+        return (1, False, False, None) if load else (0, True, False, None)
+    if instr & 0x0FC000F0 == 0x00000090:    # mul, mla
+        return instr >> 21 & 1, False, False, instr >> 8 & 15
+    if instr & 0x0F8000F0 == 0x00800090:    # umull, smull, umlal, smlal
+        return 1 + (instr >> 21 & 1), False, False, instr >> 8 & 15
+    if instr & 0x0FB00FF0 == 0x01000090:    # swp
+        return 1, True, False, None
+    if instr & 0x0E000090 == 0x00000090 and instr & 0x60:   # halfword and signed transfers
+        return (1, False, False, None) if instr >> 20 & 1 else (0, True, False, None)
+    if instr & 0x0C000000 == 0x04000000 or instr & 0x0E000000 == 0x08000000:  # single and block transfers
+        return (1, False, False, None) if instr >> 20 & 1 else (0, True, False, None)
+    if instr & 0x0FFFFFF0 == 0x012FFF10: return 0, False, False, None   # bx
+    if instr & 0x0E000010 == 0x00000010: return 1, False, False, None   # data processing with a register shift
+    return 0, False, False, None
+
+
+def timeInstruction(addr, instr, mode):
+    """Adds the cycles of the instruction at *addr*, other than its data accesses and any pipeline refill"""
+
+    global Cycles, DataSeq
+    DataSeq = 0
+    region = addr >> 24 & 15
+    N, S = Waits[4 - 2*mode]
+    if not mode and instr >> 28 != 14 and not conditions[instr >> 28](cpsr()>>28):
+        Cycles += S[region]
+        return
+    kind = Kinds[mode].get(instr)
+    if kind is None: kind = Kinds[mode][instr] = classify(instr, mode)
+    internal, store, bl, multiplier = kind
+    Cycles += S[region] + internal
+    if store: Cycles += N[region] - S[region]
+    if bl: Cycles += S[region]
+    if multiplier is not None:
+        value = REG[multiplier] & 0xFFFFFFFF
+        if value >> 31: value ^= 0xFFFFFFFF
+        Cycles += 1 if value < 2**8 else 2 if value < 2**16 else 3 if value < 2**24 else 4
+
+
+def refill():
+    """Adds the cycles to refill the pipeline after a jump"""
+
+    global Cycles
+    region = REG[15] >> 24 & 15
+    N, S = Waits[2 if REG[16] & 32 else 4]
+    Cycles += N[region] + S[region]
@@ -0,0 +1,148 @@
+import math
+from Components import ARMCPU, Memory
+
+
+# High-level emulation of the GBA BIOS functions called through swi.  Each handler takes the registers to work on,
+# reads its source in one slice and writes its result with one mem_write, so watchpoints, the journal and compiled
+# blocks still see the writes.  It returns an estimate of the cycles the real BIOS function takes, which is added
+# to ARMCPU.Cycles while cycles are counted, so the write itself goes through the untimed writer.
+M = 0xFFFFFFFF
+
+
+def store(addr, data):
+    if data: (ARMCPU.TimedWrite if ARMCPU.Timing else ARMCPU.mem_write)(addr, data)
+
+
+def signed(value):
+    return (value & M ^ 2**31) - 2**31
+
+
+def div(R, numerator, denominator):
+    if not denominator: return 20  # the real BIOS never returns
+    n, d = signed(numerator), signed(denominator)
+    quotient = abs(n) // abs(d) * (1 if (n < 0) == (d < 0) else -1)
+    R[0], R[1], R[3] = quotient & M, (n - quotient*d) & M, abs(quotient) & M
+    return 60
+
+
+def Div(R): return div(R, R[0], R[1])
+def DivArm(R): return div(R, R[1], R[0])
+
+
+def Sqrt(R):
+    R[0] = math.isqrt(R[0] & M)
+    return 120
+
+
+def ArcTan2(R):
+    R[0] = round(math.atan2(signed(R[1]), signed(R[0])) / (2*math.pi) * 0x10000) & 0xFFFF
+    return 100
+
+
+def CpuSet(R):
+    src, des, control = R[0], R[1], R[2]
+    unit = 4 if control >> 26 & 1 else 2
+    count = control & 0x1FFFFF
+    src, des = src & ~(unit - 1), des & ~(unit - 1)
+    if control >> 24 & 1: store(des, Memory.load(src, unit)*count); return 30 + 6*count
+    store(des, Memory.load(src, unit*count))
+    return 30 + 9*count
+
+
+def CpuFastSet(R):
+    src, des, control = R[0] & ~3, R[1] & ~3, R[2]
+    count = -(-(control & 0x1FFFFF) // 8)*8
+    if control >> 24 & 1: store(des, Memory.load(src, 4)*count); return 30 + 2*count
+    store(des, Memory.load(src, 4*count))
+    return 30 + 3*count
+
+
+def BitUnPack(R):
+    src, des, info = R[0], R[1], R[2]
+    length, srcwidth, deswidth = Memory.read(info, 2), Memory.read(info + 2, 1), Memory.read(info + 3, 1)
+    offset = Memory.read(info + 4, 4)
+    zeros, offset = offset >> 31, offset & 0x7FFFFFFF
+    if srcwidth not in {1, 2, 4, 8} or deswidth not in {1, 2, 4, 8, 16, 32}: return 60
+    out = bytearray()
+    word = bits = 0
+    for byte in Memory.load(src, length):
+        for shift in range(0, 8, srcwidth):
+            value = byte >> shift & (1 << srcwidth) - 1
+            if value or zeros: value += offset
+            word |= (value & (1 << deswidth) - 1) << bits
+            bits += deswidth
+            if bits == 32: out += word.to_bytes(4, "little"); word = bits = 0
+    store(des & ~3, out)
+    return 60 + 20*length*8//srcwidth
+
+
+def LZ77UnComp(R):
+    src, des = R[0] & ~3, R[1]
+    size = Memory.read(src, 4) >> 8
+    data = Memory.load(src + 4, size + (size + 7)//8 + 2)
+    out = bytearray()
+    pos = 0
+    while len(out) < size:
+        flags = data[pos]; pos += 1
+        for bit in range(8):
+            if len(out) >= size: break
+            if flags << bit & 0x80:
+                length, disp = (data[pos] >> 4) + 3, ((data[pos] & 15) << 8 | data[pos+1]) + 1
+                pos += 2
+                if disp > len(out): out += bytes(length)
+                else: out += (out[-disp:] * (length//disp + 1))[:length]  # the copy may repeat its own output
+            else: out.append(data[pos]); pos += 1
+    store(des, out[:size])
+    return 60 + 12*size
+
+
+def RLUnComp(R):
+    src, des = R[0] & ~3, R[1]
+    size = Memory.read(src, 4) >> 8
+    data = Memory.load(src + 4, 2*size + 2)
+    out = bytearray()
+    pos = 0
+    while len(out) < size:
+        flag = data[pos]
+        if flag & 0x80: out += data[pos+1:pos+2]*((flag & 0x7F) + 3); pos += 2
+        else: out += data[pos+1:pos+2+(flag & 0x7F)]; pos += 2 + (flag & 0x7F)
+    store(des, out[:size])
+    return 60 + 6*size
+
+
+def HuffUnComp(R):
+    src, des = R[0] & ~3, R[1]
+    header = Memory.read(src, 4)
+    width, size = header & 15, header >> 8
+    if width not in {4, 8}: return 60
+    treesize = (Memory.read(src + 4, 1) + 1)*2
+    data = Memory.load(src + 4, treesize + 8*size + 4)  # the tree, then the bits, in 32-bit words read from the top
+    symbols = []
+    needed = size*8//width
+    node, pos = 1, treesize
+    while len(symbols) < needed and pos + 4 <= len(data):
+        word = int.from_bytes(data[pos:pos+4], "little"); pos += 4
+        for bit in range(31, -1, -1):
+            direction = word >> bit & 1
+            child = (node & ~1) + (data[node] & 0x3F)*2 + 2 + direction
+            if data[node] & 0x80 >> direction:
+                symbols.append(data[child] & (1 << width) - 1)
+                node = 1
+                if len(symbols) == needed: break
+            else: node = child
+    if width == 4: symbols = [low | high << 4 for low, high in zip(symbols[::2], symbols[1::2])]
+    store(des & ~3, bytes(symbols))
+    return 80 + 30*size
+
+
+# swi number -> handler
+Handlers = {
+    0x06: Div, 0x07: DivArm, 0x08: Sqrt, 0x0A: ArcTan2, 0x0B: CpuSet, 0x0C: CpuFastSet, 0x10: BitUnPack,
+    0x11: LZ77UnComp, 0x12: LZ77UnComp, 0x13: HuffUnComp, 0x14: RLUnComp, 0x15: RLUnComp,
+}
+
+
+def install():
+    """Makes the CPU emulate these BIOS functions when swi calls them"""
+
+    ARMCPU.Swis.update(Handlers)
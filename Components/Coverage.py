@@ -0,0 +1,133 @@
+import gzip
+import re
+from struct import Struct
+from Components import ARMCPU, Memory
+from Components.FunctionFlow import indexedBounds
+
+
+# A coverage file is Magic followed by, for each bitmap, Header (name, byte length) and the bitmap, gzipped
+Magic = b"ARMCOV01"
+Header = Struct("<4sI")
+Areas = {0: (b"BIOS", 0, 0x3FFF), 3: (b"IWRM", 0x03000000, 0x7FFF), 8: (b"ROM", 0x08000000, 0x1FFFFFF), 9: (b"ROM", 0x08000000, 0x1FFFFFF)}
+Bitmaps = {}     # name -> bytearray with one bit per halfword of code executed, lowest address in the lowest bit
+Covered = set()  # (start, end) of code already marked, so running it again is only a set lookup
+
+
+def sizes():
+    """Returns the size in bytes of each bitmap for the memory currently loaded"""
+
+    return {b"BIOS": 0x4000 >> 4, b"IWRM": 0x8000 >> 4, b"ROM": len(Memory.ROM) + 15 >> 4}
+
+
+def cover(start, end):
+    """Marks the halfwords from *start* up to *end* as executed; called by the CPU while recording coverage"""
+
+    if (start, end) in Covered: return
+    Covered.add((start, end))
+    area = Areas.get(start >> 24)
+    if not area: return
+    name, base, mask = area
+    bitmap = Bitmaps[name]
+    first = (start & mask) >> 1
+    for i in range(first, first + (end - start >> 1)):
+        if i >> 3 < len(bitmap): bitmap[i >> 3] |= 1 << (i & 7)
+
+
+def start():
+    """Starts recording coverage, adding to the coverage recorded so far"""
+
+    for name, size in sizes().items():
+        bitmap = Bitmaps.setdefault(name, bytearray(size))
+        if len(bitmap) < size: bitmap.extend(bytes(size - len(bitmap)))
+    Covered.clear()  # the bitmaps may have been reallocated or cleared since the code was marked
+    ARMCPU.Cover = cover
+
+
+def stop():
+    ARMCPU.Cover = None
+
+
+def clear():
+    """Forgets the coverage recorded so far"""
+
+    for bitmap in Bitmaps.values(): bitmap[:] = bytes(len(bitmap))
+    Covered.clear()
+
+
+def save(filepath, bitmaps=None):
+    """Writes *bitmaps*, or the coverage recorded so far, to *filepath*"""
+
+    with gzip.open(filepath, "wb") as f:
+        f.write(Magic)
+        for name, bitmap in (Bitmaps if bitmaps is None else bitmaps).items():
+            f.write(Header.pack(name, len(bitmap)))
+            f.write(bitmap)
+
+
+def load(filepath):
+    """Returns the bitmaps saved to *filepath*"""
+
+    bitmaps = {}
+    with gzip.open(filepath, "rb") as f:
+        if f.read(len(Magic)) != Magic: raise ValueError(f"{filepath} is not a coverage file")
+        while header := f.read(Header.size):
+            name, size = Header.unpack(header)
+            bitmaps[name.rstrip(b"\0")] = bytearray(f.read(size))
+    return bitmaps
+
+
+def merge(filepath):
+    """Adds the coverage saved to *filepath* to the coverage recorded so far"""
+
+    for name, bitmap in load(filepath).items():
+        current = Bitmaps.setdefault(name, bytearray(len(bitmap)))
+        if len(current) < len(bitmap): current.extend(bytes(len(bitmap) - len(current)))
+        value = int.from_bytes(current, "little") | int.from_bytes(bitmap, "little")
+        current[:] = value.to_bytes(len(current), "little")
+
+
+def difference(a, b):
+    """Returns the bitmaps of the code executed in *a* but not in *b*"""
+
+    result = {}
+    for name, bitmap in a.items():
+        other = b.get(name, b"")[:len(bitmap)]
+        other = int.from_bytes(other, "little")
+        result[name] = (int.from_bytes(bitmap, "little") & ~other).to_bytes(len(bitmap), "little")
+    return result
+
+
+def ranges(bitmaps):
+    """Yields (start, end) of each run of executed code in *bitmaps*, in order of address"""
+
+    bases = {name: base for name, base, mask in Areas.values()}
+    for name, bitmap in sorted(bitmaps.items(), key=lambda x: bases.get(x[0], 0)):
+        if name not in bases: continue
+        run = None
+        for m in re.finditer(rb"[^\0]+", bitmap):
+            for pos in range(8*m.start(), 8*m.end()):
+                addr = bases[name] + 2*pos
+                if bitmap[pos >> 3] >> (pos & 7) & 1:
+                    if run and run[1] == addr: run[1] = addr + 2
+                    else:
+                        if run: yield tuple(run)
+                        run = [addr, addr + 2]
+        if run: yield tuple(run)
+
+
+def byFunction(bitmaps):
+    """Returns {(start, end) of a function in the ROM function index, or None: [(start, end) of each run]} for
+    the code executed in *bitmaps*, with runs split where functions end
+
+    The bitmaps don't record the mode, so word aligned runs are looked up in the ARM index first.
+    """
+    groups = {}
+    for start, end in ranges(bitmaps):
+        arm = not (start | end) & 3
+        while start < end:
+            bounds, size = arm and indexedBounds(start, 0), 4
+            if not bounds: bounds, size = indexedBounds(start), 2
+            stop = min(end, bounds[1] + size) if bounds else end
+            groups.setdefault(bounds and bounds[:2], []).append((start, stop))
+            start = stop
+    return groups
@@ -1,28 +1,14 @@
 import re
+import multiprocessing
 from bisect import bisect_right
+from Components import Memory
+from Components.ARMCPU import decodeTable, armIndex
+from Components.Memory import read as mem_read
 
 
-BIOS, RAM, ROM = bytearray(), bytearray(), bytearray()
-RegionMarkers = {}
 suffixes = ["eq","ne","cs","cc","mi","pl","vs","vc","hi","ls","ge","lt","gt","le","","nv"]
 
 
-def mem_read(addr,size=4):
-    region = addr >> 24 & 0xF
-    if region in RegionMarkers:
-        base, length = RegionMarkers[region]
-        reladdr = (addr & 0xFFFFFF) % length + base
-        return int.from_bytes(RAM[reladdr:reladdr + size],"little")
-    else:
-        if region >= 8:
-            reladdr = addr - 0x08000000
-            return int.from_bytes(ROM[reladdr:reladdr+size],"little")  
-        elif region == 0:
-            reladdr = addr % 0x4000
-            return int.from_bytes(BIOS[reladdr:reladdr+size],"little")
-        else: return 0
-
-
 ThumbBounds = (
     0x1800,0x2000,0x4000,0x4400,0x4800,0x5000,0x6000,0x9000,0xA000,0xB000,0xB100,
     0xB400,0xBE00,0xC000,0xD000,0xDE00,0xDF00,0xE000,0xE800,0xF000,0xF800,0x10000,0xF800F000
@@ -39,23 +25,14 @@ ArmTree = {
 }
 
 
+ArmTable = decodeTable(ArmTree)
+
+
 def getFuncIndex(instr,Mode):
     if Mode: 
         return bisect_right(ThumbBounds,instr)
     else:
-        treepos = 0
-        while True:
-            try: 
-                condition = ArmTree[treepos][0]
-                if type(condition) is int:
-                    if instr>>condition & 1: treepos = ArmTree[treepos][1]
-                    else: treepos += 1
-                else:
-                    bitmask,value = condition
-                    if instr & bitmask == value: treepos = ArmTree[treepos][1]
-                    else: treepos += 1
-            except TypeError:
-                return ArmTree[treepos]
+        return ArmTable[armIndex(instr)]
 
 
 def rlist(number):
@@ -142,50 +119,162 @@ ArmDisasmTree = {
 
 
 
-def disasm(instr, Mode=1, pc=None):
-    FuncID = getFuncIndex(instr,Mode)
-    if Mode: 
-        template = ThumbDisasmTree[FuncID]
-    else:
-        template = ArmDisasmTree[FuncID]
-        c = suffixes[instr>>28]
-
-    def getsegment(bitmask):  # returns a segment of instr
-        return (instr & bitmask) >> (int.bit_length(bitmask & -bitmask) - 1)
-
-    out = ""
-    index = 0
-    while index < len(template):
-        code = template[index]
-        init = index
-        T = type(code) 
+def segment(bitmask):
+    """Returns the source of an expression for the segment of instr selected by *bitmask*"""
+
+    shift = int.bit_length(bitmask & -bitmask) - 1
+    return f"(instr >> {shift} & {bitmask >> shift:#x})"
+
+
+def compileTemplate(template):
+    """Compiles a disassembly template into a function(instr, pc) that returns the text it describes
+
+    Jumps in the template only go forward, so each one just sets the index of the next step to run, and
+    steps that some jump can skip are guarded by that index.  Returns (function, whether the text depends on pc).
+    """
+    steps = []  # (source, jump target or None)
+    end = len(template)
+    for index, code in enumerate(template):
+        T = type(code)
+        source, target = "", None
         if T is tuple:
             arg1,*arg2 = code
             T2 = type(arg1)
-            if T2 is tuple: out += arg1[getsegment(arg2[0])]  # [(strings), bitmask] selects a string based on bitmask
-            elif T2 is str: out += arg1.format(*map(lambda x:getsegment(x),arg2))  # [str, bitmasks] inserts bitmasks into str
-            elif T2 is int:
-                if getsegment(1<<arg1): index += arg2[0]  # if correct bit is on, jump
-            elif T2 is list:  # [bitmask, values] if bitmask is in values, jump
-                if getsegment(arg1[0]) in arg1[1:]: index += arg2[0]
-        elif T is str: out += code  # adds str to output
-        elif T is int: index += code  # jumps ahead
-        elif T is list:  # [str, bitmasks, format] inserts bitmasks into str, then evaluates, and formats
+            if T2 is tuple: source = f"out += {arg1!r}[{segment(arg2[0])}]"
+            elif T2 is str: source = f"out += {arg1!r}.format({', '.join(map(segment, arg2))})"
+            elif T2 is int: source, target = f"if instr >> {arg1} & 1: nxt = {{}}", index + arg2[0]
+            elif T2 is list: source, target = f"if {segment(arg1[0])} in {tuple(arg1[1:])!r}: nxt = {{}}", index + arg2[0]
+        elif T is str: source = f"out += {code!r}"
+        elif T is int: source, target = "nxt = {}", index + code
+        elif T is list:
             arg1,*arg2 = code
             if arg2:
                 fstr = arg2.pop() if type(arg2[-1]) is str else ""
-                if fstr == "addr":  # presets for address strings
-                    fstr = "0>8X" if pc else "X"
-                newstr = eval(arg1.format(*map(lambda x:getsegment(x),arg2)))
-                out += f"{newstr:{fstr}}"
-            else: out += eval(arg1)
-        if index == init: index += 1
-        elif index < init: break
-
-    if pc:  # replaces relative addresses with true addresses (and values in case of ldr)
+                fstr = "'0>8X' if pc else 'X'" if fstr == "addr" else repr(fstr)  # presets for address strings
+                source = f"out += format({arg1.format(*map(segment, arg2))}, {fstr})"
+            else: source = f"out += {arg1}"
+        if target is not None and target < index: target = end  # backward jumps end the template
+        steps.append((source, target))
+
+    lines = ["def formatter(instr, pc):", "    c = suffixes[instr >> 28]", "    out = ''", "    nxt = 0"]
+    for index, (source, target) in enumerate(steps):
+        if target is not None: source = source.format(target)
+        if any(j < index < t for j, (_, t) in enumerate(steps[:index]) if t is not None):
+            source = f"if nxt <= {index}:\n        {source}" if source.startswith("if") else f"if nxt <= {index}: {source}"
+        lines.append("    " + source)
+    lines.append("    return out")
+    namespace = {}
+    exec("\n".join(lines), globals(), namespace)
+    usespc = any(type(code) is list and ("pc" in code[0] or code[-1] == "addr") for code in template)
+    return namespace["formatter"], usespc
+
+
+ThumbFormatters = [compileTemplate(ThumbDisasmTree[i]) for i in range(len(ThumbDisasmTree))]
+ArmFormatters = [compileTemplate(ArmDisasmTree[i]) for i in range(len(ArmDisasmTree))]
+
+Cache = {}  # (instr, Mode) -> text of instructions that don't depend on pc
+CacheLimit = 0x10000
+pcrelative = re.compile(r"\[pc, \$?([0-9a-fx]+)\]")
+
+
+def disasm(instr, Mode=1, pc=None):
+    out = Cache.get((instr, Mode))
+    if out is None:
+        formatter, usespc = (ThumbFormatters if Mode else ArmFormatters)[getFuncIndex(instr,Mode)]
+        out = formatter(instr, pc).replace("r13","sp").replace("r14","lr").replace("r15","pc").replace("$-","-$")
+        if not usespc:
+            if len(Cache) >= CacheLimit: Cache.clear()
+            Cache[instr, Mode] = out
+
+    if pc and "[pc, " in out:  # replaces relative addresses with true addresses (and values in case of ldr)
         def subs(matchobj): 
             addr = (pc&~2) + int(matchobj.group(1), 16)
             return f"[${addr:0>8X}] (=${mem_read(addr,4):0>8X})"
-        out = re.sub(r"\[r15, \$?([0-9a-fx]+)\]", subs, out)
+        out = pcrelative.sub(subs, out)
+
+    return out or "[???]"
+
+
+ChunkSize = 0x40000  # bytes of ROM per dumpasm task
+
+
+def literalPool(start, end, mode):
+    """Returns the ROM offsets in [start, end) that pc-relative ldr instructions load a word from"""
+
+    ROM = Memory.ROM
+    literals = set()
+    with memoryview(ROM)[:len(ROM) & ~3] as view:
+        if mode:
+            lo = max(0, start - 0x400) & ~1
+            with view[lo:end & ~1].cast("H") as halves:
+                for i, instr in enumerate(halves):
+                    if 0x4800 <= instr < 0x5000:  # ldr rn, [pc, nn]
+                        literals.add((lo + 2*i + 4 & ~2) + 4*(instr & 0xFF))
+        else:
+            lo = max(0, start - 0x1000) & ~3
+            with view[lo:end & ~3].cast("I") as words:
+                for i, instr in enumerate(words):
+                    if instr & 0x0F7F0000 == 0x051F0000:  # ldr rd, [pc, #+-nn]
+                        literals.add(lo + 4*i + 8 + (instr & 0xFFF if instr & 1<<23 else -(instr & 0xFFF)))
+    return {i for i in literals if start <= i < end and not i & 3}
+
+
+def listChunk(task):
+    """Returns the disassembly of ROM offsets [start, end) as text; the task run by each dumpasm worker"""
+
+    start, end, mode = task
+    ROM = Memory.ROM
+    literals = literalPool(start, end, mode)
+    out = []
+    pos = start
+    size = len(ROM)
+    while pos < end and pos + 2 <= size:
+        addr = 0x08000000 + pos
+        if pos in literals and pos + 4 <= size:
+            word = int.from_bytes(ROM[pos:pos+4], "little")
+            if mode: out.append(f"{addr:0>8X}: {word & 0xFFFF:0>4x} {word >> 16:0>4x}  .word ${word:0>8X}")
+            else: out.append(f"{addr:0>8X}: {word:0>8x}   .word ${word:0>8X}")
+            pos += 4
+        elif mode:
+            instr = ROM[pos] | ROM[pos+1] << 8
+            if 0xF000 <= instr < 0xF800 and pos + 4 <= size:
+                instr |= (ROM[pos+2] | ROM[pos+3] << 8) << 16
+                out.append(f"{addr:0>8X}: {instr & 0xFFFF:0>4x} {instr>>16:0>4x}  {disasm(instr,1,addr+4)}")
+                pos += 4
+            else:
+                out.append(f"{addr:0>8X}: {instr:0>4x}       {disasm(instr,1,addr+4)}")
+                pos += 2
+        else:
+            if pos + 4 > size: break
+            instr = int.from_bytes(ROM[pos:pos+4], "little")
+            out.append(f"{addr:0>8X}: {instr:0>8x}   {disasm(instr,0,addr+8)}")
+            pos += 4
+    out.append("")
+    return "\n".join(out)
+
+
+def dumpasm(start, end, filepath, mode=1, processes=None):
+    """Writes the disassembly of the ROM from *start* up to *end* to *filepath*
+
+    Words loaded by pc-relative ldr instructions are listed as .word instead of being disassembled.  The range
+    is split into chunks that start on an instruction boundary, and the chunks are disassembled by a process
+    pool where processes can be forked; elsewhere they run in this process.  Returns the number of bytes listed.
+    """
+    ROM = Memory.ROM
+    start = max(start - 0x08000000, 0) & ~(3 - 2*mode)
+    end = min(end - 0x08000000, len(ROM))
+    bounds = [start]
+    for pos in range(start + ChunkSize & ~3, end, ChunkSize):
+        # a chunk mustn't start on the second half of a bl
+        while mode and pos < end and 0xF000 <= ROM[pos-2] | ROM[pos-1] << 8 < 0xF800: pos += 4
+        if bounds[-1] < pos < end: bounds.append(pos)
+    bounds.append(end)
+    tasks = [(lo, hi, mode) for lo, hi in zip(bounds, bounds[1:]) if lo < hi]
 
-    return out.replace("r13","sp").replace("r14","lr").replace("r15","pc").replace("$-","-$") or "[???]"
+    with open(filepath, "w", buffering=2**20) as f:
+        if len(tasks) > 1 and "fork" in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                for text in pool.imap(listChunk, tasks): f.write(text)
+        else:
+            for task in tasks: f.write(listChunk(task))
+    return max(end - start, 0)
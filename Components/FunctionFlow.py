@@ -1,7 +1,14 @@
 
-RAM = bytearray()
+import gzip
+import hashlib
+import json
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from Components.Memory import read
+
+
 ROM = bytearray()
-RegionMarkers = {}
 
 
 def bl_offset(data):
@@ -16,15 +23,7 @@ def minmax(bounds, entry):
 
 
 def mem_read(addr,size=2):
-    region = addr >> 24 & 0xF
-    if region in RegionMarkers:
-        base, length = RegionMarkers[region]
-        reladdr = (addr & 0xFFFFFF) % length + base
-        value = int.from_bytes(RAM[reladdr:reladdr + size],"little")
-    else:
-        reladdr = addr - 0x08000000
-        value = int.from_bytes(ROM[reladdr:reladdr+size],"little")
-    return value
+    return read(addr,size)
 
 
 def generateFuncList(addr, depth=0):
@@ -35,83 +34,38 @@ def generateFuncList(addr, depth=0):
         depth   -- set to a number > 0 to limit the search depth
     """
 
-    s = hex(addr)[2:].zfill(8)
+    s = f"{addr:0>8x}"
     path = [s]
-    currentFuncList = [set()]
     totalFuncList = set()
-    currentDataRange = [[]]
-
-    def navigate_tree(addr):
-        nonlocal s
-        newentry = ""
-        stepinto = True
-        endfunc = False
+    stack = [enumerate(getCallees(addr))]
+    while stack:
+        for i, (newaddr, stepinto) in stack[-1]:
+            newentry = f"{newaddr:0>8x}"
+            if i:
+                print(s)
+                s = f"{' '*(len(path)*13-3)}|- {newentry}"
+            else: 
+                s += " --- " + newentry
 
-        while True:
-            instr = mem_read(addr)
-
-            # ldr rn, [pc, nn]; updates the local data range
-            if 0x4800 <= instr < 0x5000:
-                minmax(currentDataRange[-1], (addr+4 & ~2) + 4*(instr & 0xFF))
-
-            # bl instructions
-            elif 0xF000 <= instr < 0xF800 and mem_read(addr + 2) >= 0xF800:
-                newaddr = addr + bl_offset(mem_read(addr, 4))
-                newentry = f"{newaddr:0>8x}"
-                addr += 2
-
-            # bx instructions
-            elif 0x4700 <= instr <= 0x4770:
-                if instr <= 0x4738 and (instr & 0x38) >> 3 | 0x48 == ROM[(addr & 0xFFFFFF)-1]:  # if bx rn and last instr was ldr rn, [pc, nn]
-                    newaddr = mem_read((addr+2 & ~2) + 4*ROM[(addr & 0xFFFFFF)-2], 4)
-                    newentry = f"{newaddr-(newaddr&1):0>8x}"
-                    if not (newaddr & 1 and newaddr>>27 & 1): stepinto = False # if it's not thumb, don't step into it
-                    newaddr &= ~1
-                endfunc = True
-
-            # pop {pc}
-            elif instr>>8 == 0xBD: endfunc = True
-            
-            if newentry and newentry not in currentFuncList[-1]:
-                currentFuncList[-1].add(newentry)
-                if len(currentFuncList[-1]) > 1:
-                    print(s)
-                    s = f"{' '*(len(path)*13-3)}|- {newentry}"
-                else: 
-                    s += " --- " + newentry
-
-                # step into the new function recursively
-                if stepinto and (depth == 0 or depth > len(path)) and newentry not in totalFuncList:
-                    totalFuncList.add(newentry)
-                    currentFuncList.append(set())
-                    currentDataRange.append([])
-                    path.append(newentry)
-                    navigate_tree(newaddr)
-
-            # return by exiting navigate_tree
-            if endfunc:
-                currentFuncList.pop()
-                currentDataRange.pop()
-                path.pop()
+            # step into the new function
+            if stepinto and (depth == 0 or depth > len(path)) and newentry not in totalFuncList:
+                totalFuncList.add(newentry)
+                path.append(newentry)
+                stack.append(enumerate(getCallees(newaddr)))
                 break
-
-            newentry = ""
-            addr += 2
-            if currentDataRange[-1] and addr >= min(currentDataRange[-1]): 
-                addr = max(currentDataRange[-1]) + 4; currentDataRange[-1].clear()
-
-    navigate_tree(addr)
+        else:
+            stack.pop()
+            path.pop()
     print(s)
+    saveCallGraph()
 
 
-def functionBounds(addr, mode=1):
-    base = addr
-    instrsize = 2 if mode==1 else 4
-    value = mem_read(addr, instrsize)
-    endfunc = 0
+def endChecks(mode):
+    """Returns (startcheck, endcheck) for *mode*; endcheck takes the instruction and its address"""
+
     if mode == 1:
         startcheck = lambda x: x & 0xff00 == 0xb500
-        def endcheck(value):
+        def endcheck(value, addr):
             if value & 0xff00 == 0xbd00:
                 return True
             elif value & 0xff80 == 0x4700:
@@ -120,40 +74,510 @@ def functionBounds(addr, mode=1):
                 return mem_read(addr-2) & 0xffff == 0xbc00 | 2**reg
             else:
                 return False
-    elif mode == 0:
+    else:
         startcheck = lambda x: x == 0x02004778 or x & 0x0F3F4000 == 0x092D4000
-        endcheck = lambda x: x == 0xE12FFF1E or x & 0x0FBF8000 == 0x08BD8000
+        endcheck = lambda x, addr: x == 0xE12FFF1E or x & 0x0FBF8000 == 0x08BD8000
+    return startcheck, endcheck
+
+
+def scanFunction(start, mode=1, limit=None):
+    """Scans down from *start* to the end of the function, skipping literal pools
+
+    Returns (end, linecount, end of a literal pool that hasn't been reached yet or None), or None if
+    no end is found within *limit* bytes.
+    """
+    instrsize = 2 if mode==1 else 4
+    endcheck = endChecks(mode)[1]
+    blcount = 0
+    datarange = []
+    addr = start
+    value = mem_read(addr, instrsize)
+    while not endcheck(value, addr): # search down for pop {r0-r7, pc} or bx rn instructions
+        if mode == 1:
+            if value & 0xf800 == 0xf000: blcount += 1; addr += 2
+            elif value & 0xf800 == 0x4800: minmax(datarange, (addr+4 & ~2) + 4*(value & 0xFF)) # update datarange for ldr rn, [pc, nn]
+        elif mode == 0:
+            if value & 0x0E9F0000 == 0x049F0000:
+                minmax(datarange, addr+8 + value & 0xFFF)
+        addr += instrsize
+        if datarange and addr >= min(datarange):  # if addr has entered datarange, count bl instructions and branch
+            while addr < max(datarange) + 4:
+                if mode==1 and 0xf800f800 & mem_read(addr, 4) == 0xf800f000:
+                    blcount += 1; addr += 2
+                addr += instrsize
+            datarange.clear()
+        if limit is not None and addr - start > limit: return None
+        value = mem_read(addr, instrsize)
+
+    if mode==1: linecount = (addr-start)//2 + 1 - blcount
+    elif mode==0: linecount = (addr-start)//4 + 1
+    return addr, linecount, max(datarange) if datarange else None
+
+
+def scanBounds(addr, mode=1):
+    """Finds the function containing *addr* by scanning the ROM around it; returns (start, end, linecount)"""
+
+    base = addr
+    instrsize = 2 if mode==1 else 4
+    startcheck, endcheck = endChecks(mode)
+    value = mem_read(addr, instrsize)
+    endfunc = 0
     while not startcheck(value): # search up for push {lr} instructions, or ends of functions
         addr -= instrsize
         value = mem_read(addr, instrsize)
-        if endcheck(value):
+        if endcheck(value, addr):
             endfunc += 1
             if endfunc == 2: break
     start = addr
     while True:
-        blcount = 0
-        datarange = []
-        addr = start
-        value = mem_read(addr, instrsize)
-        while not endcheck(value): # search down for pop {r0-r7, pc} or bx rn instructions
-            if mode == 1:
-                if value & 0xf800 == 0xf000: blcount += 1; addr += 2
-                elif value & 0xf800 == 0x4800: minmax(datarange, (addr+4 & ~2) + 4*(value & 0xFF)) # update datarange for ldr rn, [pc, nn]
-            elif mode == 0:
-                if value & 0x0E9F0000 == 0x049F0000:
-                    minmax(datarange, addr+8 + value & 0xFFF)
-            addr += instrsize
-            if datarange and addr >= min(datarange):  # if addr has entered datarange, count bl instructions and branch
-                while addr < max(datarange) + 4:
-                    if mode==1 and 0xf800f800 & mem_read(addr, 4) == 0xf800f000:
-                        blcount += 1; addr += 2
-                    addr += instrsize
-                datarange.clear()
-            value = mem_read(addr, instrsize)
-        if addr >= base: break
-        elif datarange: start = max(datarange) + 4
-        else: start = addr + instrsize
+        end, linecount, dataend = scanFunction(start, mode)
+        if end >= base: break
+        elif dataend is not None: start = dataend + 4
+        else: start = end + instrsize
+    return start, end, linecount
 
-    if mode==1: linecount = (addr-start)//2 + 1 - blcount
-    elif mode==0: linecount = (addr-start)//4 + 1
-    return start, addr, linecount
+
+##########################
+### ROM FUNCTION INDEX ###
+##########################
+
+
+FunctionIndex = {}  # mode -> (starts, ends, linecounts) sorted by start, built on first use
+CachePath = ""      # path of the ROM; the index and call graph are cached next to it, keyed by the ROM's hash
+IndexChanged = False
+ScanLimit = 0x10000 # functions without an end within this many bytes aren't indexed
+blpair = re.compile(rb"(?=[\x00-\xff][\xf0-\xf7][\x00-\xff][\xf8-\xff])")
+pushlr = re.compile(rb"(?=[\x00-\xff]\xb5)")
+
+
+def findStarts(lo, hi, mode=1):
+    """Returns the function starts found between ROM offsets *lo* and *hi*, as absolute addresses
+
+    Thumb functions start at push {lr} instructions; ARM functions start at stmfd sp!, {lr}.  The bl targets are
+    found by calledStarts, once the functions calling them are indexed.
+    """
+    starts = set()
+    lo = max(lo, 0)
+    if mode == 1:
+        for m in pushlr.finditer(ROM, lo, hi + 1):
+            if not m.start() & 1 and m.start() < hi: starts.add(0x08000000 + m.start())
+    else:
+        startcheck = endChecks(0)[0]
+        lo &= ~3
+        with memoryview(ROM)[lo:hi & ~3] as view, view.cast("I") as words:
+            for i, value in enumerate(words):
+                if startcheck(value): starts.add(0x08000000 + lo + 4*i)
+    return starts
+
+
+def calledStarts(lo, hi):
+    """Returns the targets of the bl instructions between ROM offsets *lo* and *hi* that lie inside an indexed Thumb
+    function and aren't indexed yet
+
+    Only bl instructions reached by a function scan count, so words in literal pools and data that look like a bl
+    don't add starts.
+    """
+    starts, ends, counts = FunctionIndex[1]
+    reach = list(accumulate(ends, max))  # the furthest end of the functions up to each start, as functions can nest
+    targets = set()
+    lo = max(lo, 0)
+    for m in blpair.finditer(ROM, lo, hi + 3):
+        pos = m.start()
+        if pos & 1 or pos >= hi: continue
+        i = bisect_right(starts, 0x08000000 + pos) - 1
+        if i < 0 or reach[i] < 0x08000000 + pos: continue
+        target = pos + bl_offset(int.from_bytes(ROM[pos:pos+4], "little"))
+        if not 0 <= target < len(ROM): continue
+        i = bisect_left(starts, 0x08000000 + target)
+        if i == len(starts) or starts[i] != 0x08000000 + target: targets.add(0x08000000 + target)
+    return targets
+
+
+def indexFunctions(starts, mode=1):
+    """Returns {start: (end, linecount)} for the *starts* whose end can be found"""
+
+    bounds = {}
+    for start in starts:
+        result = scanFunction(start, mode, ScanLimit)
+        if result: bounds[start] = result[:2]
+    return bounds
+
+
+def storeIndex(mode, bounds):
+    """Adds *bounds*, {start: (end, linecount)}, to the index, replacing the entries with the same starts"""
+
+    starts, ends, counts = FunctionIndex.setdefault(mode, ([], [], []))
+    for start in sorted(bounds):
+        i = bisect_left(starts, start)
+        if i < len(starts) and starts[i] == start: ends[i], counts[i] = bounds[start]
+        else: starts.insert(i, start); ends.insert(i, bounds[start][0]); counts.insert(i, bounds[start][1])
+
+
+def indexRange(lo, hi, mode, stale=()):
+    """Indexes the *stale* starts and the functions starting between ROM offsets *lo* and *hi*, then the Thumb
+    functions called from inside the functions found"""
+
+    starts = FunctionIndex.setdefault(mode, ([], [], []))[0]
+    indexed = starts[bisect_left(starts, 0x08000000 + lo):bisect_left(starts, 0x08000000 + hi)]
+    bounds = indexFunctions(sorted(findStarts(lo, hi, mode).difference(indexed).union(stale)), mode)
+    storeIndex(mode, bounds)
+    if mode == 1:
+        hi = max([hi] + [end + 4 - 0x08000000 for end, count in bounds.values()])
+        storeIndex(mode, indexFunctions(sorted(calledStarts(lo, hi)), mode))
+
+
+def romHash():
+    return hashlib.sha1(ROM).hexdigest()
+
+
+def loadCache(suffix):
+    """Returns the data cached in CachePath + *suffix* for this ROM, or None"""
+
+    try:
+        with gzip.open(CachePath + suffix, "rt") as f: cache = json.load(f)
+        if cache["sha1"] == romHash(): return cache["data"]
+    except (OSError, ValueError, KeyError): pass
+
+
+def saveCache(suffix, data):
+    if not CachePath: return
+    try:
+        with gzip.open(CachePath + suffix, "wt") as f: json.dump({"sha1": romHash(), "data": data}, f)
+    except OSError: pass
+
+
+def resetCaches(rompath=""):
+    """Discards the function index, call graph and cross references; call when a new ROM is loaded"""
+
+    global CachePath, CallGraphLoaded, IndexChanged, XRefsChanged, DataRefsChanged
+    FunctionIndex.clear()
+    IndexChanged = False
+    CallGraph.clear()
+    CallGraphLoaded = False
+    XRefs.clear()
+    XRefSites.clear()
+    XRefsChanged = False
+    DataRefs.clear()
+    DataRefSites.clear()
+    DataRefsChanged = False
+    CachePath = rompath
+
+
+def loadIndex():
+    """Loads the index cached for this ROM, or builds it with a pass over the whole ROM and caches it"""
+
+    cache = loadCache(".funcs")
+    if cache:
+        for mode in (0, 1): FunctionIndex[mode] = tuple(cache[mode])
+        return
+    for mode in (0, 1): indexRange(0, len(ROM), mode)
+    saveCache(".funcs", [FunctionIndex[0], FunctionIndex[1]])
+
+
+def saveIndex():
+    """Caches the index if it was patched since it was last saved"""
+
+    global IndexChanged
+    if IndexChanged: saveCache(".funcs", [FunctionIndex[0], FunctionIndex[1]])
+    IndexChanged = False
+
+
+def patchIndex(addr, size):
+    """Updates the index entries affected by writing *size* bytes to the ROM at *addr*"""
+
+    global IndexChanged
+    if not FunctionIndex: return
+    lo, hi = addr, addr + size
+    for mode in (0, 1):
+        starts, ends, counts = FunctionIndex[mode]
+        # functions whose scan covers the written bytes are rescanned, along with any starts found in them; a scan
+        # spans at most ScanLimit bytes, so only the starts that close to the write are checked
+        first, last = bisect_left(starts, lo - ScanLimit - 4), bisect_left(starts, hi)
+        stale = [i for i in range(first, last) if ends[i] + 4 > lo]
+        rescan = min([starts[i] for i in stale] + [lo]), max([ends[i] + 4 for i in stale] + [hi])
+        starts = [starts[i] for i in stale]
+        for i in reversed(stale): del FunctionIndex[mode][0][i], ends[i], counts[i]
+        indexRange(rescan[0] - 0x08000000, rescan[1] - 0x08000000, mode, starts)
+    IndexChanged = True
+
+
+def indexedBounds(addr, mode=1):
+    """Returns (start, end, linecount) of the function containing *addr* in the ROM function index, or None"""
+
+    if 0x08000000 <= addr < 0x08000000 + len(ROM):
+        if not FunctionIndex: loadIndex()
+        saveIndex()
+        starts, ends, counts = FunctionIndex[mode]
+        i = bisect_right(starts, addr) - 1
+        if i >= 0 and ends[i] >= addr: return starts[i], ends[i], counts[i]
+
+
+def functionBounds(addr, mode=1):
+    """Returns (start, end, linecount) of the function containing *addr*
+
+    Uses the ROM function index when *addr* is inside an indexed function, and scans the ROM otherwise.
+    """
+    return indexedBounds(addr, mode) or scanBounds(addr, mode)
+
+
+##################
+### CALL GRAPH ###
+##################
+
+
+CallGraph = {}  # Thumb function -> (last address walked, [(callee, whether to step into it)])
+CallGraphLoaded = False
+CallGraphChanged = False
+
+
+def walkFunction(addr):
+    """Walks the Thumb function at *addr* up to its end, skipping literal pools
+
+    Returns (last address walked, callees), where callees lists the targets of bl instructions and of
+    ldr rn, [pc, nn] + bx rn tail calls in order, each with whether it's Thumb code that can be stepped into.
+    """
+    start = addr
+    callees = []
+    seen = set()
+    datarange = []
+    while addr - start <= ScanLimit:
+        instr = mem_read(addr)
+        newaddr = None
+        stepinto = True
+        endfunc = False
+
+        # ldr rn, [pc, nn]; updates the local data range
+        if 0x4800 <= instr < 0x5000:
+            minmax(datarange, (addr+4 & ~2) + 4*(instr & 0xFF))
+
+        # bl instructions
+        elif 0xF000 <= instr < 0xF800 and mem_read(addr + 2) >= 0xF800:
+            newaddr = addr + bl_offset(mem_read(addr, 4))
+            addr += 2
+
+        # bx instructions
+        elif 0x4700 <= instr <= 0x4770:
+            if instr <= 0x4738 and (instr & 0x38) >> 3 | 0x48 == ROM[(addr & 0xFFFFFF)-1]:  # if bx rn and last instr was ldr rn, [pc, nn]
+                newaddr = mem_read((addr+2 & ~2) + 4*ROM[(addr & 0xFFFFFF)-2], 4)
+                stepinto = bool(newaddr & 1 and newaddr>>27 & 1)  # if it's not thumb, don't step into it
+                newaddr &= ~1
+            endfunc = True
+
+        # pop {pc}
+        elif instr>>8 == 0xBD: endfunc = True
+
+        if newaddr is not None and newaddr not in seen:
+            seen.add(newaddr)
+            callees.append((newaddr, stepinto))
+        if endfunc: break
+        addr += 2
+        if datarange and addr >= min(datarange): 
+            addr = max(datarange) + 4; datarange.clear()
+    return addr, callees
+
+
+def getCallees(addr):
+    """Returns the memoized callees of the Thumb function at *addr*"""
+
+    global CallGraphLoaded, CallGraphChanged
+    if not CallGraphLoaded:
+        CallGraph.update({int(k): (end, [tuple(i) for i in callees]) for k, (end, callees) in (loadCache(".calls") or {}).items()})
+        CallGraphLoaded = True
+    if addr not in CallGraph:
+        CallGraph[addr] = walkFunction(addr)
+        CallGraphChanged = True
+    return CallGraph[addr][1]
+
+
+def saveCallGraph():
+    global CallGraphChanged
+    if CallGraphChanged: saveCache(".calls", CallGraph)
+    CallGraphChanged = False
+
+
+def buildCallGraph(roots=None):
+    """Returns {function: callees} for every function reachable from *roots*
+
+    By default the roots are all the Thumb functions in the ROM function index.
+    """
+    if roots is None:
+        if not FunctionIndex: loadIndex()
+        roots = FunctionIndex[1][0]
+    graph = {}
+    stack = list(roots)
+    while stack:
+        addr = stack.pop()
+        if addr in graph: continue
+        graph[addr] = [newaddr for newaddr, stepinto in getCallees(addr)]
+        stack.extend(newaddr for newaddr, stepinto in getCallees(addr) if stepinto)
+    saveCallGraph()
+    return graph
+
+
+def exportCallGraph(filepath, roots=None):
+    """Writes the call graph to *filepath*, as Graphviz DOT if it ends in .dot and as JSON otherwise"""
+
+    graph = buildCallGraph(roots)
+    with open(filepath, "w") as f:
+        if filepath.lower().endswith(".dot"):
+            f.write("digraph calls {\n")
+            for addr in sorted(graph):
+                f.write(f'    "{addr:0>8X}";\n')
+                for newaddr in graph[addr]: f.write(f'    "{addr:0>8X}" -> "{newaddr:0>8X}";\n')
+            f.write("}\n")
+        else:
+            json.dump({f"{addr:0>8X}": [f"{i:0>8X}" for i in graph[addr]] for addr in sorted(graph)}, f, indent=1)
+    return len(graph)
+
+
+########################
+### CROSS REFERENCES ###
+########################
+
+
+XRefs = {}          # "targets", "callers": parallel lists of every branch in the ROM, sorted by target
+XRefSites = []      # (caller & ~1, target, caller) for every branch, sorted; built by the first patch
+XRefsChanged = False
+armbranch = re.compile(rb"(?=[\x00-\xff]{3}[" + b"".join(re.escape(bytes([cond << 4 | op])) for cond in range(15) for op in (0xA, 0xB)) + rb"])")
+
+
+def scanBranches(lo, hi):
+    """Returns (target, caller) for each bl and ARM b/bl instruction starting between ROM offsets *lo* and *hi*
+
+    Callers are absolute addresses, with bit 0 set for Thumb instructions.
+    """
+    branches = []
+    lo = max(lo, 0)
+    for m in blpair.finditer(ROM, lo, hi + 3):
+        pos = m.start()
+        if pos & 1 or pos >= hi: continue
+        target = pos + bl_offset(int.from_bytes(ROM[pos:pos+4], "little"))
+        if 0 <= target < len(ROM): branches.append((0x08000000 + target, 0x08000001 + pos))
+    for m in armbranch.finditer(ROM, lo, hi + 3):
+        pos = m.start()
+        if pos & 3 or pos >= hi: continue
+        target = pos + 8 + 4*((int.from_bytes(ROM[pos:pos+3], "little") ^ 2**23) - 2**23)
+        if 0 <= target < len(ROM): branches.append((0x08000000 + target, 0x08000000 + pos))
+    return branches
+
+
+def storeXRefs(branches):
+    branches.sort()
+    XRefs["targets"] = [target for target, caller in branches]
+    XRefs["callers"] = [caller for target, caller in branches]
+    XRefSites.clear()
+
+
+def spliceRefs(keys, items, sites, lo, hi, found):
+    """Replaces the references whose item lies between *lo* and *hi* with *found*, a list of (key, item)
+
+    *keys* and *items* are parallel lists sorted by (key, item).  *sites* holds (item & ~1, key, item) for each of
+    them, sorted, so the references in the range are found by bisect instead of by walking the whole index.
+    """
+    if not sites: sites.extend(sorted((item & ~1, key, item) for key, item in zip(keys, items)))
+    first, last = bisect_left(sites, (lo,)), bisect_left(sites, (hi,))
+    for _, key, item in sites[first:last]:
+        i = bisect_left(keys, key)
+        i = bisect_left(items, item, i, bisect_right(keys, key, i))
+        del keys[i], items[i]
+    for key, item in found:
+        i = bisect_left(keys, key)
+        i = bisect_left(items, item, i, bisect_right(keys, key, i))
+        keys.insert(i, key); items.insert(i, item)
+    sites[first:last] = sorted((item & ~1, key, item) for key, item in found)
+
+
+def loadXRefs():
+    """Loads the cross references cached for this ROM, or finds them with a pass over the whole ROM and caches them"""
+
+    cache = loadCache(".xrefs")
+    if cache: XRefs.update(cache)
+    else:
+        storeXRefs(scanBranches(0, len(ROM)))
+        saveCache(".xrefs", XRefs)
+
+
+def findCallers(addr):
+    """Returns the addresses of the branches to *addr*, with bit 0 set for Thumb instructions"""
+
+    global XRefsChanged
+    if not XRefs: loadXRefs()
+    if XRefsChanged: saveCache(".xrefs", XRefs)
+    XRefsChanged = False
+    targets = XRefs["targets"]
+    addr &= ~1
+    return XRefs["callers"][bisect_left(targets, addr):bisect_right(targets, addr)]
+
+
+def patchXRefs(addr, size):
+    """Updates the cross references affected by writing *size* bytes to the ROM at *addr*"""
+
+    global XRefsChanged
+    if not XRefs: return
+    lo, hi = addr - 3, addr + size
+    spliceRefs(XRefs["targets"], XRefs["callers"], XRefSites, lo, hi, scanBranches(lo - 0x08000000, hi - 0x08000000))
+    XRefsChanged = True
+
+
+DataRefs = {}       # "values", "addrs": parallel lists of every aligned ROM word that points into EWRAM, IWRAM or the ROM, sorted by value
+DataRefSites = []   # (addr, value, addr) for every pointer, sorted; built by the first patch
+DataRefsChanged = False
+pointer = re.compile(rb"(?=[\x00-\xff]{3}[\x02\x03\x08\x09])")
+
+
+def scanPointers(lo, hi):
+    """Returns (value, address) for each aligned word between ROM offsets *lo* and *hi* that points into EWRAM, IWRAM or the ROM"""
+
+    pointers = []
+    lo = max(lo, 0) & ~3
+    for m in pointer.finditer(ROM, lo, hi + 3):
+        pos = m.start()
+        if pos & 3 or pos >= hi: continue
+        pointers.append((int.from_bytes(ROM[pos:pos+4], "little"), 0x08000000 + pos))
+    return pointers
+
+
+def storeDataRefs(pointers):
+    pointers.sort()
+    DataRefs["values"] = [value for value, addr in pointers]
+    DataRefs["addrs"] = [addr for value, addr in pointers]
+    DataRefSites.clear()
+
+
+def findPointers(addr, size=1):
+    """Returns (address, value) for each aligned ROM word whose value is between *addr* and *addr* + *size*"""
+
+    global DataRefsChanged
+    if not DataRefs:
+        cache = loadCache(".refs")
+        if cache: DataRefs.update(cache)
+        else:
+            storeDataRefs(scanPointers(0, len(ROM)))
+            saveCache(".refs", DataRefs)
+    if DataRefsChanged: saveCache(".refs", DataRefs)
+    DataRefsChanged = False
+    values = DataRefs["values"]
+    lo, hi = bisect_left(values, addr), bisect_left(values, addr + size)
+    return list(zip(DataRefs["addrs"][lo:hi], values[lo:hi]))
+
+
+def patchDataRefs(addr, size):
+    """Updates the pointers affected by writing *size* bytes to the ROM at *addr*"""
+
+    global DataRefsChanged
+    if not DataRefs: return
+    lo, hi = addr & ~3, addr + size  # the first word overlapping the write
+    spliceRefs(DataRefs["values"], DataRefs["addrs"], DataRefSites, lo, hi, scanPointers(lo - 0x08000000, hi - 0x08000000))
+    DataRefsChanged = True
+
+
+def patchROM(addr, size):
+    """Updates the function index, call graph and cross references after *size* bytes of the ROM at *addr* were written"""
+
+    patchIndex(addr, size)
+    patchXRefs(addr, size)
+    patchDataRefs(addr, size)
+    global CallGraphChanged
+    for start in [i for i, (end, _) in CallGraph.items() if i < addr + size and end + 4 > addr]:
+        del CallGraph[start]
+        CallGraphChanged = True
@@ -0,0 +1,110 @@
+import hashlib
+import tempfile
+import zlib
+
+
+PageSize = 0x1000
+MemoryLimit = 256*2**20  # bytes of RAM pages kept in memory; past this, the oldest saves are compressed, then moved to disk
+Compress = True
+
+Saves = {}          # name -> [page digests, or a temporary file once moved to disk; registers], oldest first
+Pages = {}          # digest -> page, shared by every save and position holding the same bytes
+Refs = {}           # digest -> number of references to the page
+Cold = set()        # digests of the pages stored compressed
+Stored = 0          # total size of Pages
+Base = None         # (digests, data) of the RAM last saved or loaded; new saves only hash the pages that differ from it
+
+
+def addPage(page):
+    global Stored
+    digest = hashlib.blake2b(page, digest_size=16).digest()
+    if digest not in Pages:
+        Pages[digest] = page
+        Stored += len(page)
+    return digest
+
+
+def getPage(digest):
+    return zlib.decompress(Pages[digest]) if digest in Cold else Pages[digest]
+
+
+def acquire(digests):
+    for digest in digests: Refs[digest] = Refs.get(digest, 0) + 1
+
+
+def release(digests):
+    global Stored
+    for digest in digests:
+        Refs[digest] -= 1
+        if not Refs[digest]:
+            del Refs[digest]
+            Stored -= len(Pages.pop(digest))
+            Cold.discard(digest)
+
+
+def setBase(digests, data):
+    global Base
+    if digests is not None: acquire(digests)
+    if Base and Base[0] is not None: release(Base[0])
+    Base = digests, data
+
+
+def save(name, ram, reg):
+    """Saves a copy of *ram* and *reg* to *name*"""
+
+    if name in Saves: delete(name)
+    data = bytes(ram)
+    digests = []
+    samesize = Base and Base[0] is not None and len(Base[1]) == len(data)
+    for i, pos in enumerate(range(0, len(data), PageSize)):
+        page = data[pos:pos+PageSize]
+        if samesize and page == Base[1][pos:pos+PageSize]: digests.append(Base[0][i])
+        else: digests.append(addPage(page))
+    acquire(digests)
+    Saves[name] = [tuple(digests), reg.copy()]
+    setBase(tuple(digests), data)
+    trim()
+
+
+def load(name):
+    """Returns (ram, reg) as saved to *name*"""
+
+    record = Saves.pop(name)
+    Saves[name] = record
+    pages, reg = record
+    if type(pages) is tuple:
+        data = b"".join(map(getPage, pages))
+        setBase(pages, data)
+    else:
+        pages.seek(0)
+        data = zlib.decompress(pages.read())
+        setBase(None, data)
+    return data, reg.copy()
+
+
+def delete(name):
+    pages, reg = Saves.pop(name)
+    if type(pages) is tuple: release(pages)
+    else: pages.close()
+
+
+def trim():
+    """Compresses the pages of the oldest saves, then moves the oldest saves to disk, until within MemoryLimit"""
+
+    global Stored
+    if Compress:
+        for pages, reg in list(Saves.values()):
+            if Stored <= MemoryLimit: return
+            if type(pages) is not tuple: continue
+            for digest in set(pages) - Cold:
+                page = zlib.compress(Pages[digest], 1)
+                Stored += len(page) - len(Pages[digest])
+                Pages[digest] = page
+                Cold.add(digest)
+    for name, record in list(Saves.items()):
+        if Stored <= MemoryLimit: return
+        if type(record[0]) is not tuple: continue
+        f = tempfile.TemporaryFile()
+        f.write(zlib.compress(b"".join(map(getPage, record[0])), 1))
+        release(record[0])
+        record[0] = f
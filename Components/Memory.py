@@ -0,0 +1,108 @@
+from struct import Struct, error as StructError
+
+
+BIOS, RAM, ROM = bytearray(), bytearray(), bytearray()
+RegionMarkers = {}
+
+# addr >> 12 -> (buffer, offset of the page within the buffer), for every 4 KB page that maps linearly into a buffer.
+# Pages that are unmapped, or that wrap around a mirrored region partway through, are None and go through locate()
+Pages = [None]*0x10000
+
+Unpack = {1: Struct("<B").unpack_from, 2: Struct("<H").unpack_from, 4: Struct("<I").unpack_from}
+SignedUnpack = {1: Struct("<b").unpack_from, 2: Struct("<h").unpack_from, 4: Struct("<i").unpack_from}
+Pack = {1: Struct("<B").pack_into, 2: Struct("<H").pack_into, 4: Struct("<I").pack_into}
+Unpack16, Unpack32 = Unpack[2], Unpack[4]
+
+
+def locate(addr):
+    """Returns (buffer, offset) for *addr*, or (None, 0) if it isn't mapped to any buffer"""
+
+    region = addr >> 24 & 0xF
+    if region in RegionMarkers:
+        base, length = RegionMarkers[region]
+        return RAM, (addr & 0xFFFFFF) % length + base
+    elif region >= 8:
+        return ROM, addr - 0x08000000
+    elif region == 0:
+        return BIOS, addr % 0x4000
+    return None, 0
+
+
+def remap():
+    """Rebuilds the page table; call whenever RegionMarkers changes, or a buffer is replaced or resized"""
+
+    for page in range(0x10000):
+        buffer, offset = locate(page << 12)
+        if buffer is None or offset + 0x1000 > len(buffer): Pages[page] = None
+        elif buffer is RAM:
+            base, length = RegionMarkers[page >> 12]
+            Pages[page] = (RAM, offset) if offset - base + 0x1000 <= length else None
+        else: Pages[page] = buffer, offset
+
+
+def read(addr,size=4,signed=False):
+    """Reads *size* bytes at *addr* as a little-endian integer"""
+
+    try:
+        buffer, offset = Pages[addr >> 12]
+        if signed: return SignedUnpack[size](buffer, offset + (addr & 0xFFF))[0] & 0xFFFFFFFF
+        return Unpack[size](buffer, offset + (addr & 0xFFF))[0]
+    except (TypeError, IndexError, KeyError, StructError):
+        buffer, offset = locate(addr)
+        if buffer is None: return 0
+        value = int.from_bytes(buffer[offset:offset+size], "little")
+        if signed:
+            msb = 2**(8*size-1)
+            value = ((value^msb) - msb) & 0xFFFFFFFF
+        return value
+
+
+def read16(addr):
+    try:
+        buffer, offset = Pages[addr >> 12]
+        return Unpack16(buffer, offset + (addr & 0xFFF))[0]
+    except (TypeError, IndexError, StructError): return read(addr, 2)
+
+
+def read32(addr):
+    try:
+        buffer, offset = Pages[addr >> 12]
+        return Unpack32(buffer, offset + (addr & 0xFFF))[0]
+    except (TypeError, IndexError, StructError): return read(addr, 4)
+
+
+def write(addr,data,size=4):
+    """Writes *data* to *addr*; *data* may be an integer *size* bytes wide, or a bytes-like object"""
+
+    if type(data) is int:
+        try:
+            buffer, offset = Pages[addr >> 12]
+            return Pack[size](buffer, offset + (addr & 0xFFF), data & (1 << 8*size) - 1)
+        except (TypeError, IndexError, KeyError, StructError):
+            data = int.to_bytes(data % 2**(8*size), size, "little")
+    buffer, offset = locate(addr)
+    if buffer is not None and offset < len(buffer): buffer[offset:offset+len(data)] = data[:len(buffer) - offset]
+
+
+def load(addr,size):
+    """Returns the *size* bytes at *addr*, with zeros past the end of its memory"""
+
+    buffer, offset = locate(addr)
+    if buffer is None: return bytes(size)
+    with memoryview(buffer) as view: data = bytes(view[offset:offset+size])
+    return data + bytes(size - len(data))
+
+
+def copy(src,des,size):
+    """Copies *size* bytes from *src* to *des*, reading zeros past the end of the source's memory"""
+
+    srcbuffer, srcoffset = locate(src)
+    desbuffer, desoffset = locate(des)
+    if desbuffer is None: return
+    size = min(size, len(desbuffer) - desoffset)
+    with memoryview(desbuffer) as view:
+        if srcbuffer is None: view[desoffset:desoffset+size] = bytes(size)
+        else:
+            data = srcbuffer[srcoffset:srcoffset+size]
+            view[desoffset:desoffset+len(data)] = data
+            view[desoffset+len(data):desoffset+size] = bytes(size - len(data))
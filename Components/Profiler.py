@@ -0,0 +1,126 @@
+from array import array
+from bisect import bisect_right
+from itertools import compress
+from Components import ARMCPU, Memory
+from Components.FunctionFlow import indexedBounds
+
+
+# addr >> 24 -> (mask, counts, cycles), where counts[(addr & mask) >> 1] is the number of times the instruction at
+# addr executed, and cycles[(addr & mask) >> 1] the cycles it took while they were counted
+Areas = {}
+Arm = set()      # addresses executed in ARM mode
+Calls = {}       # called address -> [number of calls, instructions and cycles taken inside the call, including callees]
+Stack = []       # (return address, called address, Executed and ARMCPU.Cycles at the call) for each call that hasn't returned
+StackLimit = 0x400
+Executed = 0     # number of instructions counted
+Last = None      # address of the last instruction counted
+LastCycles = 0   # ARMCPU.Cycles when the last instruction was counted
+Pending = None   # (cycles, index) of the last instruction, which gets the cycles counted until the next one
+
+
+def count(addr, mode):
+    """Counts the instruction at *addr*; called by the CPU before each instruction executes while profiling"""
+
+    global Executed, Last, LastCycles, Pending
+    cycles = ARMCPU.Cycles
+    if Pending: Pending[0][Pending[1]] += cycles - LastCycles
+    Pending = None
+    area = Areas.get(addr >> 24)
+    if area:
+        i = (addr & area[0]) >> 1
+        try: area[1][i] += 1; Pending = area[2], i
+        except IndexError: pass
+    if not mode: Arm.add(addr)
+    Executed += 1
+    if Stack and addr == Stack[-1][0]:  # returned from the last call
+        ret, called, start, startcycles = Stack.pop()
+        if all(frame[1] != called for frame in Stack):
+            Calls[called][1] += Executed - 1 - start
+            Calls[called][2] += cycles - startcycles
+    elif Last is not None and ARMCPU.REG[14] & ~1 == Last + 4 and addr != Last + 4:  # the last instruction was a call
+        Calls.setdefault(addr, [0, 0, 0])[0] += 1
+        Stack.append((Last + 4, addr, Executed - 1, cycles))
+        if len(Stack) > StackLimit: del Stack[0]
+    Last, LastCycles = addr, cycles
+
+
+def start():
+    """Clears the counts and starts profiling"""
+
+    global Executed, Last, Pending
+    Areas.clear(); Arm.clear(); Calls.clear(); Stack.clear()
+    Executed, Last, Pending = 0, None, None
+    romsize = len(Memory.ROM)
+    sizes = {2: 0x20000, 3: 0x4000, 8: min(romsize, 0x1000000) + 1 >> 1, 9: romsize - 0x1000000 + 1 >> 1}
+    for region, mask in ((2, 0x3FFFF), (3, 0x7FFF), (8, 0xFFFFFF), (9, 0xFFFFFF)):
+        if sizes[region] > 0: Areas[region] = mask, array("I", bytes(4*sizes[region])), array("I", bytes(4*sizes[region]))
+    ARMCPU.Profile = count
+
+
+def settle():
+    """Adds the cycles counted since the last instruction to it"""
+
+    global LastCycles
+    if Pending: Pending[0][Pending[1]] += ARMCPU.Cycles - LastCycles
+    LastCycles = ARMCPU.Cycles
+
+
+def stop():
+    global Last, Pending
+    ARMCPU.Profile = None
+    settle()
+    Last = Pending = None
+
+
+def instructions():
+    """Returns (address, count, cycles) for each instruction executed while profiling, most executed first"""
+
+    settle()
+    result = []
+    for region, (mask, counts, cycles) in Areas.items():
+        base = region << 24
+        for i in compress(range(len(counts)), counts): result.append((base + 2*i, counts[i], cycles[i]))
+    result.sort(key=lambda x: -x[1])
+    return result
+
+
+def functions():
+    """Returns (start, end, mode, calls, exclusive, inclusive, cycles, inclusive cycles) for each function executed
+    while profiling
+
+    Functions are found in the ROM function index; instructions outside of it are counted in the function starting
+    at the nearest address below them that was called, and *start* and *end* span the instructions executed.
+    *exclusive* counts the instructions executed within the function, and *inclusive* also counts the ones executed
+    in the functions it called, for the calls that have returned or are in progress; cycles are totalled the same
+    way, and stay 0 unless cycles were being counted.  Functions that were never called count as inclusive of only
+    themselves.  Sorted by exclusive count, most executed first.
+    """
+    totals = {}  # (key, mode) -> [start, end, exclusive, cycles]
+    targets = sorted(Calls)
+    bounds = None
+    for addr, n, cycles in sorted(instructions()):
+        mode = 0 if addr in Arm else 1
+        if not (bounds and bounds[2] == mode and bounds[0] <= addr <= bounds[1]):
+            bounds = indexedBounds(addr, mode)
+            if bounds: bounds = *bounds[:2], mode
+        if bounds: key, start, end = bounds[0], bounds[0], bounds[1]
+        else:
+            i = bisect_right(targets, addr) - 1
+            key = targets[i] if i >= 0 and targets[i] >> 24 == addr >> 24 else addr >> 24 << 24
+            start = end = addr
+        entry = totals.setdefault((key, mode), [start, end, 0, 0])
+        entry[1] = max(entry[1], end)
+        entry[2] += n
+        entry[3] += cycles
+    inclusive = {addr: calls[1:] for addr, calls in Calls.items()}
+    for i, (ret, called, begin, begincycles) in enumerate(Stack):
+        if all(frame[1] != called for frame in Stack[:i]):
+            inclusive[called][0] += Executed - begin
+            inclusive[called][1] += ARMCPU.Cycles - begincycles
+    result = []
+    for (key, mode), (start, end, exclusive, cycles) in totals.items():
+        calls = Calls.get(key, (0,))[0]
+        total, totalcycles = inclusive.get(key, (0, 0))
+        result.append((start, end, mode, calls, exclusive, max(total, exclusive), cycles, max(totalcycles, cycles)))
+    result.sort(key=lambda x: -x[4])
+    return result
@@ -0,0 +1,62 @@
+from array import array
+from operator import eq, ne, gt, lt, ge, le
+from Components import Memory
+
+
+Size = 1            # size in bytes of the values being scanned
+Snapshot = b""      # copy of the RAM taken at the last scan
+Candidates = {}     # region -> indices of the values in that region that are still candidates
+Formats = {1: "B", 2: "H", 4: "I"}
+Comparisons = {"==": eq, "!=": ne, ">": gt, "<": lt, ">=": ge, "<=": le}
+Aliases = {"unchanged": "==", "changed": "!=", "increased": ">", "decreased": "<"}
+
+
+def values(buffer, region):
+    """Returns the values of *region*, *Size* bytes each, as stored in *buffer*"""
+
+    base, length = Memory.RegionMarkers[region]
+    end = min(base + length, len(buffer))
+    with memoryview(buffer)[base:end - (end - base) % Size] as view, view.cast(Formats[Size]) as data:
+        return data.tolist()
+
+
+def start(size=1, region=None):
+    """Starts a new scan of every aligned *size*-byte value in *region*, or in every region; returns the number of values"""
+
+    global Size, Snapshot
+    if size not in Formats: raise ValueError("size must be 1, 2 or 4")
+    Size = size
+    Snapshot = bytes(Memory.RAM)
+    Candidates.clear()
+    for i in (Memory.RegionMarkers if region is None else [region]):
+        Candidates[i] = array("I", range(len(values(Snapshot, i))))
+    return count()
+
+
+def narrow(op, value=None):
+    """Keeps the candidates whose value compares true to *value* by *op*; returns the number left
+
+    If *value* is None, each value is compared to what it was at the last scan instead.
+    """
+    global Snapshot
+    compare = Comparisons[Aliases.get(op, op)]
+    for region, indices in Candidates.items():
+        new = values(Memory.RAM, region)
+        if value is None:
+            old = values(Snapshot, region)
+            Candidates[region] = array("I", [i for i in indices if compare(new[i], old[i])])
+        else: Candidates[region] = array("I", [i for i in indices if compare(new[i], value)])
+    Snapshot = bytes(Memory.RAM)
+    return count()
+
+
+def count():
+    return sum(map(len, Candidates.values()))
+
+
+def results():
+    """Yields (address, value) for each candidate"""
+
+    for region, indices in sorted(Candidates.items()):
+        new = values(Memory.RAM, region)
+        for i in indices: yield 0x1000000*region + Size*i, new[i]
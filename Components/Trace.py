@@ -0,0 +1,143 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import re
+import string
+import threading
+from struct import Struct, error as StructError
+
+
+# A trace file is Magic followed by fixed-size records of (ADDR, INSTR, MODE, CPUCOUNT, r0-r16),
+# taken after each instruction executes
+Magic = b"ARMTRC01"
+Record = Struct("<IIBQ17I")
+Pack, Unpack = Record.pack_into, Record.unpack_from
+BufferSize = 0x10000*Record.size
+ChunkSize = 0x10000  # records per tracefmt task
+
+TraceFile = None
+Buffer = bytearray()
+Position = 0
+Full = queue.Queue()    # buffers waiting to be written
+Empty = queue.Queue()   # buffers written and ready for reuse
+Writer = None
+Namespace = {}          # globals that format expressions are evaluated in
+
+
+def writeBuffers(f):
+    """Writes the buffers put in Full to *f*, until it gets None; runs in the writer thread"""
+
+    while True:
+        data = Full.get()
+        if data is None: break
+        f.write(data)
+        buffer = data.obj
+        data.release()
+        Empty.put(buffer)
+
+
+def start(filepath):
+    """Starts recording a trace to *filepath*, replacing any trace being recorded"""
+
+    global TraceFile, Buffer, Position, Writer
+    stop()
+    TraceFile = open(filepath, "wb")
+    TraceFile.write(Magic)
+    Buffer, Position = bytearray(BufferSize), 0
+    Empty.put(bytearray(BufferSize))
+    Writer = threading.Thread(target=writeBuffers, args=(TraceFile,), daemon=True)
+    Writer.start()
+
+
+def record(addr, instr, mode, count, reg):
+    global Position
+    try: Pack(Buffer, Position, addr, instr, mode, count, *reg)
+    except StructError: Pack(Buffer, Position, addr, instr, mode, count, *[value & 0xFFFFFFFF for value in reg])
+    Position += Record.size
+    if Position == BufferSize: flush()
+
+
+def flush():
+    """Hands the records buffered so far to the writer thread"""
+
+    global Buffer, Position
+    if not Position: return
+    Full.put(memoryview(Buffer)[:Position])
+    Buffer, Position = Empty.get(), 0
+
+
+def stop():
+    """Writes out the trace being recorded and closes it"""
+
+    global TraceFile, Writer
+    if not TraceFile: return
+    flush()
+    Full.put(None)
+    Writer.join()
+    TraceFile.close()
+    TraceFile = Writer = None
+    while not Empty.empty(): Empty.get()
+
+
+atexit.register(stop)
+
+
+def count(filepath):
+    """Returns the number of records in the trace at *filepath*"""
+
+    with open(filepath, "rb") as f:
+        if f.read(len(Magic)) != Magic: raise ValueError(f"{filepath} is not a trace file")
+    return (os.path.getsize(filepath) - len(Magic)) // Record.size
+
+
+def renderer(layout, namespace):
+    """Compiles *layout*, a format as returned by Debugger.formatstr, into one function
+
+    The function takes (ADDR, INSTR, MODE, CPUCOUNT, REG, PCNT, SIZE) and returns the formatted text, evaluating
+    the expressions in the format in *namespace*.
+    """
+    parts = []
+    for literal, field, spec, _ in string.Formatter().parse(layout[0]):
+        if literal: parts.append(repr(literal))
+        if field is None: continue
+        expression = re.fullmatch(r"_G\[(\d+)\]", field)
+        source = f"({layout[1 + int(expression.group(1))]})" if expression else field
+        parts.append(f"format({source}, {spec!r})")
+    lines = ["def render(ADDR, INSTR, MODE, CPUCOUNT, REG, PCNT, SIZE):", f"    return ''.join(({', '.join(parts)},))"]
+    local = {}
+    exec(compile("\n".join(lines), "<format>", "exec"), namespace, local)
+    return local["render"]
+
+
+def formatChunk(task):
+    """Returns records [first, last) of a trace formatted as text; the task run by each tracefmt worker"""
+
+    filepath, first, last, layout = task
+    render = renderer(layout, Namespace)
+    with open(filepath, "rb") as f:
+        f.seek(len(Magic) + first*Record.size)
+        data = f.read((last - first)*Record.size)
+    out = []
+    for pos in range(0, len(data), Record.size):
+        addr, instr, mode, cpucount, *reg = Unpack(data, pos)
+        out.append(render(addr, instr, mode, cpucount, reg, addr + 8 - 4*mode, 4 - 2*mode))
+    return "".join(out)
+
+
+def formatTrace(tracepath, filepath, layout, processes=None):
+    """Writes the records of the trace at *tracepath* to *filepath* as text, formatted by *layout*
+
+    *layout* is a format as returned by Debugger.formatstr.  Expressions in it see the values recorded with each
+    instruction, while memory is read as it is now.  Large traces are split into chunks formatted by a process
+    pool where processes can be forked; elsewhere they run in this process.  Returns the number of records.
+    """
+    total = count(tracepath)
+    tasks = [(tracepath, i, min(i + ChunkSize, total), layout) for i in range(0, total, ChunkSize)]
+    with open(filepath, "w", buffering=2**20) as f:
+        if len(tasks) > 1 and "fork" in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                for text in pool.imap(formatChunk, tasks): f.write(text)
+        else:
+            for task in tasks: f.write(formatChunk(task))
+    return total
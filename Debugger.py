@@ -1,12 +1,12 @@
 import os, sys, traceback, gzip, re, math
-from Components import ARMCPU, Disassembler, FunctionFlow
+from Components import ARMCPU, BiosCalls, Coverage, FunctionFlow, LocalSaves, Memory, Profiler, Scanner, Trace
 
 from Components.ARMCPU import mem_read, mem_write
-from Components.Disassembler import disasm
+from Components.Disassembler import disasm, dumpasm
 from Components.Assembler import assemble
-from Components.FunctionFlow import generateFuncList, functionBounds
+from Components.FunctionFlow import generateFuncList, functionBounds, exportCallGraph, findCallers, findPointers
 
-VERSION_INFO = "Last Updated November 17th, 2020"
+VERSION_INFO = "Last Updated October 18th, 2026"
 print(f"VERSION INFO: {VERSION_INFO}")
 
 
@@ -20,6 +20,8 @@ ROMDIRECTORY = r""
 SAVEDIRECTORY = r""
 
 FileLimit = 10*2**20
+LocalSaveLimit = 256*2**20
+JournalLimit = 0
 ShowRegistersInAsmMode = True
 
 REG_INIT = [0]*15 + [0x08000004, 0]
@@ -36,9 +38,9 @@ DefaultFormat = "line"
 
 # Initialization #
 
-BIOS = bytearray(0x4000); ARMCPU.BIOS = BIOS; Disassembler.BIOS = BIOS
-RAM = bytearray(740322); ARMCPU.RAM = RAM; Disassembler.RAM = RAM; FunctionFlow.RAM = RAM
-ROM = bytearray(); ARMCPU.ROM = ROM; Disassembler.ROM = ROM; FunctionFlow.ROM = ROM
+BIOS = bytearray(0x4000); Memory.BIOS = BIOS
+RAM = bytearray(740322); Memory.RAM = RAM
+ROM = bytearray(); Memory.ROM = ROM; FunctionFlow.ROM = ROM
 REG = REG_INIT.copy(); ARMCPU.REG = REG
 RegionMarkers = {  # Base, Length pairs
     2:(0x85df,0x48400),     # WRAM
@@ -48,19 +50,19 @@ RegionMarkers = {  # Base, Length pairs
     6:(0x485df,0x60400),    # VRAM
     7:(0x685df,0x68800)     # OAM
 }
-ARMCPU.RegionMarkers = RegionMarkers
-FunctionFlow.RegionMarkers = RegionMarkers
-Disassembler.RegionMarkers = RegionMarkers
+Memory.RegionMarkers = RegionMarkers
+Memory.remap()
+BiosCalls.install()
 
 OutputHandle = None
 OutputCondition = False
+TraceCondition = False
 TerminalHandle = None
 TerminalState = False
 
 Commandque = []
 UserVars = {}
 UserFuncs = {}
-LocalSaves = {}
 
 # Load data from settings file
 try:
@@ -82,11 +84,15 @@ try:
 except FileNotFoundError as e: print(type(e).__name__ + ": Debugger_Settings.txt")
 except AttributeError as e: print(type(e).__name__ + ": Error parsing Debugger_Settings.txt")
 except Exception as e: print(type(e).__name__ + ":", e, "in Debugger_Settings.txt")
+LocalSaves.MemoryLimit = LocalSaveLimit
+Trace.Namespace = globals()
+if JournalLimit: ARMCPU.startJournal(JournalLimit)
 
 
 Matchfunc = re.compile(r"(\w*)\(\)")  # user and global functions; matching args in parentheses breaks m(...) command
 Matchassign = re.compile(r"(?<![!=<>])(?:\+|-|\*|/|//|%|<<|>>|\*\*|&|\||\^)?=(?!=)")  # match assigment operators
 Matchargs = re.compile(r"([^ :(]+)\s*:?(.*)")  # grabs the debugger command and its arguments
+Matchpattern = re.compile(r"\s*(?:(?:[0-9a-fA-F]{2}|\?\?)\s+)*(?:[0-9a-fA-F]{2}|\?\?)\s*$")  # hex bytes with ?? wildcards, like "F0 ?? F8 ??"
 Matchquotes = re.compile(r"(.*?)((?:[brf]?(?:\'.*?\'|\".*?\"))|$)")  # returns (non-string, string) pairs
 
 
@@ -104,8 +110,8 @@ def UpdateGlobalInfo():
     SIZE = 4 - 2*MODE
     PCNT = REG[15] + SIZE
     ADDR = (REG[15] - SIZE) & ~(SIZE-1)
-    INSTR = mem_read(ADDR,SIZE)
-    if MODE and INSTR & 0xF800 == 0xF000: INSTR = mem_read(ADDR,4); SIZE = 4
+    INSTR = Memory.read(ADDR,SIZE)
+    if MODE and INSTR & 0xF800 == 0xF000: INSTR = Memory.read(ADDR,4); SIZE = 4
 
 
 def reset():
@@ -114,6 +120,9 @@ def reset():
     BIOS[:] = bytearray(0x4000)
     RAM[:] = bytearray(740322)
     REG[:] = REG_INIT
+    ARMCPU.flushBlocks()
+    ARMCPU.clearJournal()
+    Coverage.Covered.clear()
     UpdateGlobalInfo()
 
 
@@ -125,6 +134,8 @@ def reset_breakpoints():
     WatchPoints = set(); ARMCPU.WatchPoints = WatchPoints
     ReadPoints = set(); ARMCPU.ReadPoints = ReadPoints
     Conditionals = []; ARMCPU.Conditionals = Conditionals
+    ARMCPU.indexPoints()
+    ARMCPU.indexConditions()
 
 
 def importrom(filepath):
@@ -133,6 +144,10 @@ def importrom(filepath):
     if os.path.isfile(defaultpath): filepath = defaultpath
     with open(filepath,"rb") as f:
         ROM[:] = bytearray(f.read())
+    Memory.remap()
+    ARMCPU.flushBlocks()
+    if ARMCPU.Cover: Coverage.start()  # sizes the bitmaps for the new ROM
+    FunctionFlow.resetCaches(filepath)
     UpdateGlobalInfo()
 
 
@@ -141,6 +156,9 @@ def importstate(filepath):
     if os.path.isfile(defaultpath): filepath = defaultpath
     with gzip.open(filepath,"rb") as f:
         RAM[:] = bytearray(f.read())
+    Memory.remap()
+    ARMCPU.flushBlocks()
+    ARMCPU.clearJournal()
     for i in range(17):
         REG[i] = int.from_bytes(RAM[24+4*i:28+4*i],"little")
     UpdateGlobalInfo()
@@ -179,13 +197,17 @@ helptext = """
     n (count)                       execute the next instruction(s), displaying the registers
     c (addr)                        continue execution up to *addr* (if addr is omitted, continues indefinitely)
     nn (count)                      execute the next instruction(s), not stepping into bl instructions
+    back (count)                    undo the last *count* instruction(s), displaying the registers
+    rc                              undo instructions up to the previous breakpoint or watchpoint hit
+    journal (count)                 record the next *count* instructions executed so that back and rc can undo them
+                                        (0 stops recording); if *count* is omitted, shows how many are recorded
     b [addr]                        set breakpoint (if addr is "all", prints all break/watch/read points)
-    bw [addr]                       set watchpoint (stops execution when *addr* is written to)
-    br [addr]                       set readpoint (stops execution when *addr* is read)
+    bw [addr] (bytecount)           set watchpoint (stops execution when any of the bytes at *addr* is written to)
+    br [addr] (bytecount)           set readpoint (stops execution when any of the bytes at *addr* is read)
     bc [condition]                  set conditional breakpoint; conditions may be any expression
     d [addr]                        delete breakpoint (if addr is "all", deletes all break/watch/read points)
-    dw [addr]                       delete watchpoint
-    dr [addr]                       delete readpoint
+    dw [addr]                       delete the watchpoints starting at *addr*
+    dr [addr]                       delete the readpoints starting at *addr*
     dc [index]                      delete conditional breakpoint by index number
     i                               print the registers
     dist [addr] (count)             display *count* instructions starting from addr in THUMB
@@ -197,6 +219,12 @@ helptext = """
     disasm [code]                   disassembles 16-bit machine code into Thumb
     fbounds [addr] (show)           detects and displays the boundaries of the function containing *addr*
                                         if *show* is anything, will print the function as well
+    xref [addr]                     lists the bl instructions, and Arm b/bl instructions, in the ROM that branch to *addr*
+    refs [addr] (size)              lists the aligned words in the ROM that point to *addr*, or anywhere in the
+                                        *size* bytes starting at *addr*
+    dumpasm [start] [end] [file] (mode)
+                                    write the disassembly of the ROM from *start* to *end* to *file*
+                                        mode=1 for THUMB (default), 0 for ARM
 
     if [condition]: [command]       execute *command* if *condition* is true
     while [condition]: [command]    repeat *command* while *condition* is true
@@ -210,8 +238,20 @@ helptext = """
                                         execute these functions later by typing in "name()"
                                         you can call functions within functions, with unlimited nesting
 
-    search [data] (size)            searches all memory for *data*, which may be a number, or byte-object
+    search [data] (size) (region) (align)
+                                    lists every address in memory where *data* is found; *data* may be a number,
+                                        a byte-object, or a string of hex bytes where ?? matches any byte, like
+                                        "F0 ?? F8 ??"; *region* restricts the search to one region of memory (8 for
+                                        the ROM), and only addresses that are multiples of *align* are listed
     tree [addr] (depth)             prints a tree of functions based on what functions are called in Thumb mode
+    callgraph [file] (addr)         writes the call graph of the functions reachable from *addr* to *file*
+                                        (JSON, or Graphviz DOT if *file* ends in .dot); if *addr* is omitted,
+                                        writes the call graph of every function in the ROM
+    scan new (size) (region)        start a scan of every *size*-byte value in RAM, or in one *region* (size=1 by default)
+    scan [op] (value)               keep the values that compare true to *value* by *op*, which is one of 
+                                        ==, !=, >, <, >=, <=; without *value*, compares each to its value at 
+                                        the last scan; changed, unchanged, increased and decreased also work
+    scan list                       list the remaining values of the scan
 
     save (name)                     create a local save; name = PRIORSTATE by default
     load (name)                     load a local save; name = PRIORSTATE by default
@@ -231,6 +271,19 @@ helptext = """
     reset                           reset the emulator (clears the RAM and resets registers)
     output [condition]              when *condition* is True, outputs to "Debugger_Output.txt" every CPU instruction
                                         if *condition* is "clear", deletes all the data in "Debugger_Output.txt"
+    trace [file] (condition)        when *condition* is True (default), records every CPU instruction to *file* in a
+                                        compact binary format; if *file* is "close", stops recording
+    tracefmt [trace] [file] (format)
+                                    writes the instructions recorded in *trace* to *file* as text, formatted by
+                                        *format* (the current output format by default)
+    profile [on/off]                start/stop counting how many times each instruction executes
+    profile report (count)          list the *count* functions and instructions executed the most while profiling
+    cycles [on/off/reset]           start/stop counting the cycles each instruction takes, or set CYCLES to 0;
+                                        "cycles" alone prints CYCLES and how many frames it spans
+    cov [on/off/clear]              start/stop recording which code executes, or forget the code recorded so far
+    cov [save/load] [file]          write the coverage recorded so far to *file*, or add the coverage in *file* to it
+    covdiff [file1] (file2)         list the code executed in *file1* but not in *file2*, grouped by function; if
+                                        *file2* is omitted, lists the code executed now but not in *file1*
     terminal (command)              can bind the terminal to "Debugger_Settings.txt"
                                         *command* may be true/false; if omitted, the bound status is toggled
                                         if *command* is "clear", clears the terminal
@@ -350,13 +403,32 @@ def showreg():
     print(f"{s}CPSR: {cpsr_str(REG[16])}  {REG[16]:0>8X}")
 
 
-def search(data, size=None):
-    data = tobytes(data, size)
-    i = 0
-    for mem in (BIOS, RAM, ROM):
-        try: pos = mem.index(data); return pos, i
-        except ValueError: i += 1
-    return -1, i
+def search(data, size=None, region=None, align=1):
+    """Yields the address of every match of *data* in memory, in order of address
+
+    *data* may be a number, a byte-object, or a string of hex bytes separated by spaces where ?? matches any byte, 
+    like "F0 ?? F8 ??". If *region* is given, only that region of memory is searched (8 for the ROM). Only addresses 
+    that are multiples of *align* are matched.
+    """
+    if type(data) is str and Matchpattern.match(data):
+        tokens = data.split()
+        pattern = re.compile(b"".join(b"." if i == "??" else re.escape(bytes([int(i, 16)])) for i in tokens), re.S)
+        # the longest run of literal bytes is found with bytes.find, and the pattern is only matched there
+        runs = re.finditer(r"(?:[0-9a-fA-F]{2})+", "".join("  " if i == "??" else i for i in tokens))
+        run = max(runs, key=lambda m: len(m.group()), default=None)
+        data, offset = (bytes.fromhex(run.group()), run.start()//2) if run else (b"", 0)
+    else: pattern, data, offset = None, tobytes(data, size), 0
+    areas = [(0, BIOS, 0, len(BIOS))]
+    areas += [(0x1000000*i, RAM, base, base + length) for i, (base, length) in sorted(RegionMarkers.items())]
+    areas += [(0x08000000, ROM, 0, len(ROM))]
+    for addr, mem, start, end in areas:
+        if region is not None and addr >> 24 != min(region, 8): continue
+        addr -= start
+        pos = mem.find(data, start + offset, end)
+        while pos != -1:
+            pos -= offset
+            if not (addr + pos) % align and (pattern is None or pattern.match(mem, pos, end)): yield addr + pos
+            pos = mem.find(data, pos + offset + 1, end)
 
 
 expstr_compile = (
@@ -483,22 +555,68 @@ def getConsoleCommands():
     def com_nn(count=1):
         global Show, Pause, PauseCount, SkipFuncs
         Show, Pause, PauseCount, SkipFuncs = True, False, expeval(count), True
+    def com_back(count=1):
+        global CPUCOUNT
+        if not ARMCPU.JournalSize: print("Error: Journal is off; start it with 'journal [count]'"); return
+        count = expeval(count)
+        undone = 0
+        while undone < count and ARMCPU.undo(): undone += 1
+        CPUCOUNT -= undone
+        UpdateGlobalInfo()
+        if undone < count: print(f"Undid {undone} instructions; reached the start of the journal")
+        showreg()
+        print(f"Next: {ADDR:0>8X}: {INSTR:0>{2*SIZE}X}  {disasm(INSTR, MODE, PCNT)}")
+    def com_rc():
+        global CPUCOUNT
+        if not ARMCPU.JournalSize: print("Error: Journal is off; start it with 'journal [count]'"); return
+        state = ""
+        while not state and ARMCPU.undo():
+            CPUCOUNT -= 1
+            UpdateGlobalInfo()
+            if ADDR in BreakPoints: state = f"BreakPoint: ${ADDR:0>8X}"
+            for expression, code, registers, ranges in ARMCPU.Conditions:
+                if eval(code): state = f"BreakPoint: {expression}"
+            addr = ARMCPU.journalWatchHit() if WatchPoints else None
+            if addr is not None: state = f"WatchPoint: {addr:0>8X}"
+        print(f"Hit {state}" if state else "Reached the start of the journal")
+        showreg()
+        print(f"Next: {ADDR:0>8X}: {INSTR:0>{2*SIZE}X}  {disasm(INSTR, MODE, PCNT)}")
+    def com_journal(count=None):
+        if count is None:
+            if ARMCPU.JournalSize:
+                print(f"{ARMCPU.JournalCount - ARMCPU.JournalFirst} instructions recorded, of up to {ARMCPU.JournalSize}")
+            else: print("Journal is off")
+        else: ARMCPU.startJournal(expeval(count))
+    def ranges(points): return [f"{i:0>8X}" + (f"-{i+size-1:0>8X}" if size > 1 else "") for i, size in sorted(points)]
+    def add_range(points, command):
+        addr, size = (*map(expeval, command.split(" ")), 1)[:2]
+        points.add((addr, size))
+        ARMCPU.indexPoints()
+    def delete_range(points, addr):
+        addr = expeval(addr)
+        points.difference_update([i for i in points if i[0] == addr])
+        ARMCPU.indexPoints()
     def com_b(addr):
         if addr == "all":
             print("BreakPoints: ", [f"{i:0>8X}" for i in sorted(BreakPoints)])
-            print("WatchPoints: ", [f"{i:0>8X}" for i in sorted(WatchPoints)])
-            print("ReadPoints:  ", [f"{i:0>8X}" for i in sorted(ReadPoints)])
+            print("WatchPoints: ", ranges(WatchPoints))
+            print("ReadPoints:  ", ranges(ReadPoints))
             print("Conditionals:", Conditionals)
         else: BreakPoints.add(expeval(addr))
-    def com_bw(addr): WatchPoints.add(expeval(addr))
-    def com_br(addr): ReadPoints.add(expeval(addr))
-    def com_bc(addr): Conditionals.append(expstr(addr))
+    def com_bw(command): add_range(WatchPoints, command)
+    def com_br(command): add_range(ReadPoints, command)
+    def com_bc(addr):
+        Conditionals.append(expstr(addr))
+        try: ARMCPU.indexConditions()
+        except SyntaxError: Conditionals.pop(); raise
     def com_d(addr):
         if addr == "all": reset_breakpoints(); print("Deleted all breakpoints")
         else: BreakPoints.remove(expeval(addr))
-    def com_dw(addr): WatchPoints.remove(expeval(addr))
-    def com_dr(addr): ReadPoints.remove(expeval(addr))
-    def com_dc(addr): Conditionals.pop(expeval(addr))
+    def com_dw(addr): delete_range(WatchPoints, addr)
+    def com_dr(addr): delete_range(ReadPoints, addr)
+    def com_dc(addr):
+        Conditionals.pop(expeval(addr))
+        ARMCPU.indexConditions()
     def com_i():
         showreg()
         print(f"Next: {ADDR:0>8X}: {INSTR:0>{2*SIZE}X}  {disasm(INSTR, MODE, PCNT)}")
@@ -507,14 +625,15 @@ def getConsoleCommands():
     def com_m(command): 
         if re.match(r"\(", command): print(expeval("m" + command))
         else: hexdump(*map(expeval, command.split(" ")))
-    def com_search(data, size=None):
-        pos, mem = search(expeval(data), expeval(size))
-        if mem == 0: print(f"{pos:0>8X}")
-        elif mem == 1:
-            for region, size in RegionMarkers.items():
-                if size[0] <= pos < sum(size): print(f"{0x1000000*region + pos-size[0]:0>8X}"); break
-        elif mem == 2: print(f"{0x08000000 + pos:0>8X}")
-        else: print("No match found")
+    def com_search(data, size=None, region=None, align=1):
+        data, size = expeval(data), expeval(size)
+        if not (type(data) is str and Matchpattern.match(data) or tobytes(data, size)):
+            print("Error: Nothing to search for; give a nonzero size or a non-empty pattern"); return
+        count = 0
+        for addr in search(data, size, expeval(region), expeval(align)):
+            print(f"{addr:0>8X}")
+            count += 1
+        if not count: print("No match found")
     def com_asm(command):
         args, asm_string = re.match(r"asm\s*([^:]*):\s*(.*)", command).groups()
         target = re.search(r"-(\S+)", args)
@@ -564,6 +683,39 @@ def getConsoleCommands():
             if show: disA(start, count)
             print(f"(${start:0>8x}, ${end:0>8x}, count={count})")
         else: print("Error: No ROM loaded")
+    def com_xref(addr):
+        if ROM:
+            callers = findCallers(expeval(addr))
+            for caller in callers:
+                if caller & 1: disT(caller & ~1)
+                else: disA(caller)
+            if not callers: print("No references found")
+        else: print("Error: No ROM loaded")
+    def com_scan(op, value=None, region=None):
+        if op == "new":
+            size = expeval(value or 1)
+            if size not in Scanner.Formats: print("Error: size must be 1, 2 or 4"); return
+            count = Scanner.start(size, expeval(region))
+            print(f"Scanning {count} values")
+        elif not Scanner.Candidates: print("Error: No scan in progress; start one with 'scan new'")
+        elif op == "list":
+            for addr, value in Scanner.results(): print(f"{addr:0>8X}: {value:0>{2*Scanner.Size}X}")
+        elif op in Scanner.Comparisons or op in Scanner.Aliases:
+            count = Scanner.narrow(op, expeval(value))
+            print(f"{count} candidates left")
+            if count <= ScanListLimit: com_scan("list")
+        else: print(f"Error: Unknown scan operation '{op}'")
+    def com_refs(addr, size=1):
+        if ROM:
+            pointers = findPointers(expeval(addr), expeval(size))
+            for addr, value in pointers: print(f"{addr:0>8X}: {value:0>8X}")
+            if not pointers: print("No references found")
+        else: print("Error: No ROM loaded")
+    def com_dumpasm(start, end, filepath, mode=1):
+        if ROM:
+            size = dumpasm(expeval(start), expeval(end), filepath, expeval(mode))
+            print(f"Disassembled {size} bytes to {filepath}")
+        else: print("Error: No ROM loaded")
     def com_if(command):
         condition, command = re.match(r"(.+?)\s*:\s*(.+)", command).groups()
         if ".." in command: command = iter(command.split(".."))
@@ -587,23 +739,29 @@ def getConsoleCommands():
     def com_tree(address, depth=0): 
         if ROM: generateFuncList(expeval(address), expeval(depth))
         else: print("No ROM loaded")
+    def com_callgraph(filepath, address=None):
+        if ROM:
+            count = exportCallGraph(filepath, None if address is None else [expeval(address)])
+            print(f"Wrote {count} functions to {filepath}")
+        else: print("No ROM loaded")
     def com_save(identifier="PRIORSTATE"): 
-        LocalSaves[identifier] = RAM.copy(), REG.copy()
+        LocalSaves.save(identifier, RAM, REG)
         print(f"Saved to {identifier}")
     def com_load(identifier="PRIORSTATE"): 
-        RAM[:] = LocalSaves[identifier][0].copy()
-        REG[:] = LocalSaves[identifier][1].copy()
+        RAM[:], REG[:] = LocalSaves.load(identifier)
+        ARMCPU.flushBlocks()
+        ARMCPU.clearJournal()
         UpdateGlobalInfo()
         print(f"Loaded {identifier}")
     def com_dv(identifier): del UserVars[identifier]
     def com_df(identifier): del UserFuncs[identifier]
-    def com_ds(identifier="PRIORSTATE"): del LocalSaves[identifier]
+    def com_ds(identifier="PRIORSTATE"): LocalSaves.delete(identifier)
     def com_vars(): print(UserVars)
     def com_funcs():
         out = []
         for k,v in UserFuncs.items(): out.append(f"'{k}': {'; '.join(v)}")
         print("{" + "\n ".join(out) + "}")
-    def com_saves(): print(list(LocalSaves))
+    def com_saves(): print(list(LocalSaves.Saves))
     def com_importrom(filepath): 
         global ROMPATH
         ROMPATH = filepath.strip('"')
@@ -642,6 +800,75 @@ def getConsoleCommands():
             if condition.lower() in {"", "true"}: OutputCondition = True
             else: OutputCondition = condition
             print("Outputting to " + OUTPUTFILE)
+    def com_trace(command):
+        global TraceCondition
+        filepath, condition = (command.split(None, 1) + ["", ""])[:2]
+        if filepath.lower() in {"close", "false", "none"}:
+            TraceCondition = False
+            Trace.stop()
+            print("Trace closed")
+        elif filepath:
+            Trace.start(filepath.strip('"'))
+            TraceCondition = True if condition.lower() in {"", "true"} else condition
+            print("Tracing to " + filepath.strip('"'))
+        else: print("Error: No trace file given")
+    def com_tracefmt(command):
+        tracepath, filepath, layout = re.match(r"tracefmt\s+(\S+)\s+(\S+)\s*(.*)", command).groups()
+        count = Trace.formatTrace(tracepath.strip('"'), filepath.strip('"'), formatstr(layout) if layout else OutputFormat)
+        print(f"Formatted {count} instructions to {filepath}")
+    def com_profile(op="report", count=None):
+        if op == "on": Profiler.start(); print("Profiling started")
+        elif op == "off": Profiler.stop(); print(f"Profiling stopped after {Profiler.Executed} instructions")
+        elif op != "report": print(f"Error: Unknown profile operation '{op}'")
+        elif not Profiler.Executed: print("Error: Nothing profiled; start profiling with 'profile on'")
+        else:
+            count, total = expeval(count or ProfileListLimit), Profiler.Executed
+            functions, instructions = Profiler.functions(), Profiler.instructions()
+            cycles = sum(i[2] for i in instructions)  # only shown if cycles were counted while profiling
+            print(f"{total} instructions profiled" + (f", {cycles} cycles" if cycles else ""))
+            print("Function               Calls     Exclusive            Inclusive" + ("            Cycles  Incl. Cycles" if cycles else ""))
+            for start, end, mode, calls, exclusive, inclusive, excycles, incycles in functions[:count]:
+                print(f"{start:0>8X}-{end:0>8X}  {calls:>8}  {exclusive:>10} {exclusive/total:>6.1%}  {inclusive:>10} {inclusive/total:>6.1%}"
+                    + (f"  {excycles:>10} {excycles/cycles:>6.1%}  {incycles:>12}" if cycles else ""))
+            print("Instruction")
+            for addr, n, ncycles in instructions[:count]:
+                mode = 0 if addr in Profiler.Arm else 1
+                instr = mem_read(addr, 4 - 2*mode)
+                if mode and 0xF000 <= instr < 0xF800: instr = mem_read(addr, 4)
+                print(f"{addr:0>8X}: {instr:0>{8 - 4*mode}X}".ljust(19), f"{disasm(instr, mode, addr + 8 - 4*mode):<24} {n:>10} {n/total:>6.1%}"
+                    + (f"  {ncycles:>10} {ncycles/cycles:>6.1%}" if cycles else ""))
+    def com_cycles(op=None):
+        global CYCLES
+        if op in {"on", "off"}:
+            ARMCPU.startTiming(op == "on")
+            print("Counting cycles" if op == "on" else f"Stopped counting cycles at {ARMCPU.Cycles}")
+        elif op == "reset": ARMCPU.Cycles = CYCLES = 0; print("Cycles reset to 0")
+        elif op is None:
+            print(f"{ARMCPU.Cycles} cycles ({ARMCPU.Cycles/FrameCycles:.2f} frames); counting is {'on' if ARMCPU.Timing else 'off'}")
+        else: print(f"Error: Unknown cycles operation '{op}'")
+    def com_cov(command):
+        op, filepath = (command.split(None, 1) + ["", ""])[:2]
+        filepath = filepath.strip().strip('"')
+        if op == "on": Coverage.start(); print("Recording coverage")
+        elif op == "off": Coverage.stop(); print("Stopped recording coverage")
+        elif op == "clear": Coverage.clear(); print("Cleared coverage")
+        elif op in {"save", "load"} and not filepath: print("Error: No coverage file given")
+        elif op == "save": Coverage.save(filepath); print(f"Saved coverage to {filepath}")
+        elif op == "load": Coverage.merge(filepath); print(f"Added the coverage in {filepath}")
+        elif not op:
+            count = sum(int.from_bytes(i, "little").bit_count() for i in Coverage.Bitmaps.values())
+            print(f"{count} halfwords of code executed; coverage is {'on' if ARMCPU.Cover else 'off'}")
+        else: print(f"Error: Unknown cov operation '{op}'")
+    def com_covdiff(command):
+        paths = [i.strip('"') for i in command.split()]
+        if not 1 <= len(paths) <= 2: print("Error: covdiff takes one or two coverage files"); return
+        first = Coverage.load(paths[0])
+        first, second = (first, Coverage.load(paths[1])) if len(paths) == 2 else (Coverage.Bitmaps, first)
+        groups = Coverage.byFunction(Coverage.difference(first, second))
+        for bounds, runs in sorted(groups.items(), key=lambda x: x[1][0]):
+            print(f"Function {bounds[0]:0>8X}-{bounds[1]:0>8X}:" if bounds else "Outside indexed functions:")
+            for start, end in runs: print(f"    {start:0>8X}-{end-1:0>8X}")
+        print(f"{sum(map(len, groups.values()))} ranges in {len(groups)} functions")
     def com_terminal(command="Toggle"):
         global TerminalHandle, TerminalState, print, input
         s = command.capitalize()
@@ -663,8 +890,9 @@ def getConsoleCommands():
             TerminalState = False
             print("Terminal unbound from " + TERMINALFILE)
     def com_format(command): 
-        global OutputFormat
+        global OutputFormat, OutputRender
         OutputFormat = formatstr(re.match(r"format\s*:?\s*(.*)", command).group(1))
+        OutputRender = Trace.renderer(OutputFormat, globals())
     def com_cls(): os.system("cls")
     def com_dir(path):
         if not path: path = None
@@ -690,13 +918,18 @@ StopAddress = None  # address to stop at (like a breakpoint)
 SkipFuncs = False  # whether to step into functions
 BreakState = ""
 CPUCOUNT = 0
+CYCLES = 0  # ARMCPU.Cycles, copied after each step
+FrameCycles = 280896  # cycles per frame (228 lines of 1232 cycles)
 lastcommand = ">"
 Modelist = {"@", "$", ">"}
 ProgramMode = ">"
+ScanListLimit = 20  # scans list their values once this few are left
+ProfileListLimit = 10  # functions and instructions listed by profile report
 OutputFormat = formatstr(DefaultFormat)
+OutputRender = Trace.renderer(OutputFormat, globals())
 
-comtype1 = {"def", "format", "asm"}  # uses the entire command
-comtype2 = {"if", "while", "rep", "repeat", "importrom", "importstate", "exportstate", "output", "dir", "chdir"}  # accepts line continuations
+comtype1 = {"def", "format", "asm", "tracefmt"}  # uses the entire command
+comtype2 = {"if", "while", "rep", "repeat", "importrom", "importstate", "exportstate", "output", "trace", "cov", "covdiff", "dir", "chdir"}  # accepts line continuations
 comtype3 = {"b", "bw", "br", "bc", "d", "dw", "dr", "dc", "m"}  # doesn't split args
 
 UpdateCheck = None
@@ -763,8 +996,8 @@ while True:
         if not BreakState:
             if ADDR in BreakPoints:
                 BreakState = f"Hit BreakPoint: ${ADDR:0>8X}"
-            for i in Conditionals:
-                if eval(i): BreakState = f"Hit BreakPoint: {i}"
+            for expression, code in ARMCPU.StepConditions:
+                if eval(code): BreakState = f"Hit BreakPoint: {expression}"
             if BreakState:
                 print(BreakState)
                 showreg()
@@ -784,8 +1017,20 @@ while True:
             print(f"Next: {ADDR:0>8X}: {INSTR:0>{2*SIZE}X}  {disasm(INSTR, MODE, PCNT)}")
             continue
 
-        ARMCPU.execute(INSTR,MODE)
-        CPUCOUNT += 1
+        # Runs until the next stop inside ARMCPU when nothing needs to see the individual instructions
+        if not (Show or PauseCount or OutputCondition or TraceCondition or ARMCPU.StepConditions):
+            executed, reason = ARMCPU.run(math.inf, () if StopAddress is None else (StopAddress,))
+            CPUCOUNT += executed
+            CYCLES = ARMCPU.Cycles
+            if reason == "interrupt": print("KeyboardInterrupt"); Pause = True
+            elif reason == "break":  # display the instruction that set the BreakState
+                MODE = REG[16]>>5 & 1; SIZE = 4 - 2*MODE
+                ADDR, PCNT = ARMCPU.BreakAddress, REG[15]
+                INSTR = mem_read(ADDR, SIZE)
+        else:
+            ARMCPU.execute(INSTR,MODE)
+            CPUCOUNT += 1
+            CYCLES = ARMCPU.Cycles
 
         # Handlers
         if ARMCPU.BreakState:
@@ -796,9 +1041,9 @@ while True:
             if Show:
                 print(f"{ADDR:0>8X}: {INSTR:0>{2*SIZE}X}".ljust(19), disasm(INSTR, MODE, PCNT))
                 showreg()
+        if TraceCondition and expeval(TraceCondition): Trace.record(ADDR, INSTR, MODE, CPUCOUNT, REG)
         if expeval(OutputCondition):
-            OutputHandle.write(OutputFormat[0].format(ADDR=ADDR, INSTR=INSTR, REG=REG, MODE=MODE, CPUCOUNT=CPUCOUNT, 
-                _G=[eval(x) for x in OutputFormat[1:]]))
+            OutputHandle.write(OutputRender(ADDR, INSTR, MODE, CPUCOUNT, REG, PCNT, SIZE))
             if OutputHandle.tell() > FileLimit:
                 order = max(0,(int.bit_length(FileLimit)-1)//10)
                 message = f"Warning: output file has exceeded {FileLimit//2**(10*order)} {('','K','M','G')[order]}B"